@@ -1,8 +1,10 @@
 # agents.py
 
 import os
+from typing import Optional
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
+from llm_client import obtener_llm
 from langgraph.prebuilt import create_react_agent
 from langchain_core.tools import StructuredTool
 
@@ -15,18 +17,26 @@ from my_tools import (
     obtener_historico_precios_tool,
     calcular_retorno_low_series,
     obtener_y_graficar,
+    graficar_comparacion,
     graficar_retorno_series,
     guardar_datos_json,
-    save_historical_data_to_db
+    exportar_historico_columnar,
+    save_historical_data_to_db,
+    obtener_indicadores,
+    consultar_historico_db
 )
 
 # --- Configuración del LLM (compartida por todos los agentes) ---
 # Se puede parametrizar o tener LLMs diferentes por agente si fuera necesario
-def get_shared_llm():
-    """Inicializa y devuelve una instancia del LLM de OpenAI."""
+def get_shared_llm(rate_limiter=None):
+    """
+    Devuelve el LLM de OpenAI compartido por el proceso (ver llm_client.py): llamadas repetidas
+    reutilizan la misma instancia, su pool de conexiones y su límite de concurrencia.
+    Opcionalmente recibe un rate limiter de LangChain (ej. InMemoryRateLimiter) para acotar las peticiones por segundo.
+    """
     if "OPENAI_API_KEY" not in os.environ:
         raise ValueError("OPENAI_API_KEY no está configurada en las variables de entorno.")
-    return ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    return obtener_llm(rate_limiter=rate_limiter)
 
 # --- Definición de los Agentes Especializados ---
 
@@ -60,8 +70,9 @@ def create_historical_data_agent(llm: ChatOpenAI) -> StructuredTool:
         ("system", """
         Eres un experto en la recuperación de datos históricos de precios (Open, High, Low, Close, Volume) para activos financieros.
         Tu objetivo es obtener series de tiempo precisas para criptomonedas y acciones utilizando las herramientas disponibles.
-        Utiliza la herramienta de CoinGecko para criptomonedas (solo OHLC) y Yahoo Finance para acciones o criptomonedas (OHLCV).
+        Utiliza la herramienta de CoinGecko para criptomonedas (OHLCV diario para cualquier número de días o rango de fechas) y Yahoo Finance para acciones o criptomonedas (OHLCV).
         Devuelve los datos de forma estructurada (generalmente un JSON string) para que puedan ser utilizados por otros agentes o presentados.
+        Si la pregunta es sobre datos ya guardados en la base de datos (resúmenes semanales/mensuales, máximos, mínimos, medias o volumen de un periodo), usa `consultar_historico_db` en lugar de volver a descargarlos.
         Si la solicitud es para graficar, **solo obtén los datos**, no intentes graficar; el agente de visualización se encargará de ello.
         Si no encuentras los datos, infórmalo claramente.
         """),
@@ -69,7 +80,8 @@ def create_historical_data_agent(llm: ChatOpenAI) -> StructuredTool:
     ])
     historical_data_tools = [
         obtener_historico_precios_coingecko_tool,
-        obtener_historico_precios_tool
+        obtener_historico_precios_tool,
+        consultar_historico_db
     ]
     return create_react_agent(llm, historical_data_tools, prompt=historical_data_prompt)
 
@@ -84,7 +96,10 @@ def create_analysis_visualization_agent(llm: ChatOpenAI) -> StructuredTool:
         Eres un experto en análisis de datos financieros y generación de visualizaciones.
         Tu objetivo es tomar datos de precios históricos y realizar cálculos (como retornos porcentuales) o generar gráficos claros y útiles.
         Siempre que generes un gráfico, devuelve la ruta del archivo PNG resultante.
+        Para comparar varios activos usa una sola llamada a `graficar_comparacion` (modo 'base100' para comparar rendimiento entre activos de precios muy distintos) en lugar de llamar a `obtener_y_graficar` por cada uno. Si su resultado incluye un aviso de tickers sin datos, díselo al usuario.
         Si se te solicita guardar datos, utiliza la herramienta correspondiente.
+        Para exportaciones grandes (varios activos o muchos años) usa `exportar_historico_columnar`, que lee los datos directamente de la fuente en lugar de recibirlos como argumento.
+        Para activos ya guardados en la base de datos, usa `obtener_indicadores` (retornos, medias móviles y volatilidad precalculados) o pasa solo el `ticker` a las herramientas de retornos en lugar de la lista de precios.
         Si los datos proporcionados son insuficientes o inválidos para el análisis/graficado, informa al usuario.
         """),
         ("human", "{messages}"),
@@ -92,9 +107,12 @@ def create_analysis_visualization_agent(llm: ChatOpenAI) -> StructuredTool:
     analysis_visualization_tools = [
         calcular_retorno_low_series,
         obtener_y_graficar,
+        graficar_comparacion,
         graficar_retorno_series,
         guardar_datos_json,
-        save_historical_data_to_db # <<< ¡AÑADIDO AQUÍ!
+        exportar_historico_columnar,
+        save_historical_data_to_db, # <<< ¡AÑADIDO AQUÍ!
+        obtener_indicadores
     ]
     return create_react_agent(llm, analysis_visualization_tools, prompt=analysis_visualization_prompt)
 # --- Agente Supervisor (Lo definiremos con LangGraph, pero aquí puedes tener su prompt inicial) ---
@@ -134,11 +152,12 @@ def get_supervisor_prompt():
     ])
 
 # --- Función principal para inicializar todos los agentes ---
-def initialize_agents():
+def initialize_agents(llm: Optional[ChatOpenAI] = None):
     """
     Inicializa todos los AgentExecutors y devuelve un diccionario de ellos.
+    Si no se pasa un LLM, se usa la instancia compartida del proceso.
     """
-    llm = get_shared_llm() # Obtener la instancia del LLM compartida
+    llm = llm or get_shared_llm() # Obtener la instancia del LLM compartida
 
     agents = {
         "asset_info_agent": create_asset_info_agent(llm),
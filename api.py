@@ -0,0 +1,200 @@
+# api.py
+"""
+API HTTP asíncrona del asistente financiero, para clientes programáticos.
+
+Envuelve el mismo agente y toolkit que app.py (pipeline.py), con un único LLM,
+agente, sesión HTTP y pool de base de datos compartidos por todas las peticiones.
+
+Endpoints:
+    POST /v1/consultas         {"consulta": "...", "thread_id": "opcional"} -> respuesta completa en JSON
+    POST /v1/consultas/stream  igual, pero emite eventos SSE (herramienta, respuesta, fin, error)
+    GET  /salud                estado y ocupación de la cola
+    GET  /metrics              métricas de telemetry.py en formato Prometheus
+
+Cada petición sin thread_id recibe uno nuevo, que se devuelve para continuar la conversación.
+Con API_CHECKPOINT_DB_URI las conversaciones se guardan en PostgreSQL; sin ella, en memoria
+acotada (MEMORIA_MAX_HILOS conversaciones, olvidadas tras MEMORIA_TTL_SEG sin uso).
+Como mucho API_MAX_CONCURRENCIA consultas se ejecutan a la vez; hasta API_MAX_EN_COLA esperan
+turno (como mucho API_ESPERA_MAX_SEG segundos) y el resto se rechaza con 503 y Retry-After.
+
+Uso:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import telemetry
+from agents import get_shared_llm
+from llm_client import cargar_openai_key, uso_llm
+from pipeline import MemoriaAcotada, crear_agente, transmitir_consulta
+
+API_MAX_CONCURRENCIA = int(os.getenv("API_MAX_CONCURRENCIA", "8"))
+API_MAX_EN_COLA = int(os.getenv("API_MAX_EN_COLA", "32"))
+API_ESPERA_MAX_SEG = float(os.getenv("API_ESPERA_MAX_SEG", "30"))
+API_CHECKPOINT_DB_URI = os.getenv("API_CHECKPOINT_DB_URI", "")
+
+
+class Consulta(BaseModel):
+    consulta: str
+    thread_id: Optional[str] = None
+
+
+class _Admision:
+    """Limita las consultas en ejecución y la longitud de la cola de espera (backpressure)."""
+
+    def __init__(self, max_concurrencia: int, max_en_cola: int, espera_max_seg: float):
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self.max_en_cola = max_en_cola
+        self.espera_max_seg = espera_max_seg
+        self.en_cola = 0
+        self.en_curso = 0
+
+    async def entrar(self):
+        """Espera turno o lanza HTTPException 503 si la cola está llena o la espera se agota."""
+        if self.en_cola >= self.max_en_cola:
+            raise HTTPException(status_code=503, detail="Servidor saturado, reintenta más tarde.",
+                                headers={"Retry-After": "5"})
+        self.en_cola += 1
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), timeout=self.espera_max_seg)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Tiempo de espera en cola agotado.",
+                                headers={"Retry-After": "5"})
+        finally:
+            self.en_cola -= 1
+        self.en_curso += 1
+
+    def salir(self):
+        self.en_curso -= 1
+        self._semaforo.release()
+
+
+class _StreamConLiberacion(StreamingResponse):
+    """
+    StreamingResponse que ejecuta 'al_terminar' siempre que Starlette la sirve, aunque el
+    generador del cuerpo no llegue a arrancar (cliente desconectado antes del primer byte).
+    """
+
+    def __init__(self, *args, al_terminar, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._al_terminar = al_terminar
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._al_terminar()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    cargar_openai_key()
+    async with AsyncExitStack() as recursos:
+        # Recursos de larga vida compartidos por todas las peticiones
+        if API_CHECKPOINT_DB_URI:
+            from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+            checkpointer = await recursos.enter_async_context(AsyncPostgresSaver.from_conn_string(API_CHECKPOINT_DB_URI))
+            await checkpointer.setup()  # crea las tablas si aún no existen
+        else:
+            checkpointer = MemoriaAcotada()
+        app.state.agente = crear_agente(get_shared_llm(), checkpointer=checkpointer)
+        app.state.admision = _Admision(API_MAX_CONCURRENCIA, API_MAX_EN_COLA, API_ESPERA_MAX_SEG)
+        yield
+
+app = FastAPI(title="Asistente Financiero IA", lifespan=lifespan)
+
+def _sse(evento: str, datos: dict) -> str:
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+@app.post("/v1/consultas")
+async def consultar(peticion: Consulta):
+    thread_id = peticion.thread_id or uuid.uuid4().hex
+    admision: _Admision = app.state.admision
+    await admision.entrar()
+    inicio = time.perf_counter()
+    respuesta, imagenes, salidas = "", [], []
+    try:
+        with telemetry.turno("api") as spans:
+            async for evento in transmitir_consulta(app.state.agente, peticion.consulta, thread_id):
+                if evento["tipo"] == "herramienta":
+                    salidas.append(evento["contenido"])
+                    if evento["imagen"]:
+                        imagenes.append(evento["imagen"])
+                else:
+                    respuesta = evento["contenido"]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al procesar la consulta: {str(e)}")
+    finally:
+        admision.salir()
+
+    return {
+        "thread_id": thread_id,
+        "respuesta": respuesta or "⚠️ No se obtuvo respuesta.",
+        "imagenes": imagenes,
+        "salidas_herramientas": salidas,
+        "duracion_seg": round(time.perf_counter() - inicio, 3),
+        "desglose": telemetry.resumen_turno(spans),
+    }
+
+@app.post("/v1/consultas/stream")
+async def consultar_stream(peticion: Consulta):
+    thread_id = peticion.thread_id or uuid.uuid4().hex
+    admision: _Admision = app.state.admision
+    # La admisión se decide antes de abrir el stream para poder responder 503 si hay saturación
+    await admision.entrar()
+    liberado = False
+
+    def _liberar():
+        # Se llama desde el finally del generador y desde la respuesta;
+        # la marca garantiza que el hueco se devuelve una sola vez
+        nonlocal liberado
+        if not liberado:
+            liberado = True
+            admision.salir()
+
+    async def _eventos():
+        inicio = time.perf_counter()
+        try:
+            yield _sse("inicio", {"thread_id": thread_id})
+            async for evento in transmitir_consulta(app.state.agente, peticion.consulta, thread_id):
+                yield _sse(evento["tipo"], evento)
+            yield _sse("fin", {"thread_id": thread_id, "duracion_seg": round(time.perf_counter() - inicio, 3)})
+        except Exception as e:
+            yield _sse("error", {"detalle": f"Error al procesar la consulta: {str(e)}"})
+        finally:
+            # También se ejecuta si el cliente se desconecta a mitad del stream
+            _liberar()
+
+    # Si el cliente se desconecta antes de que empiece el cuerpo, el generador nunca arranca
+    # y su finally no se ejecuta: la propia respuesta libera el hueco en ese caso
+    try:
+        return _StreamConLiberacion(_eventos(), media_type="text/event-stream",
+                                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                                    al_terminar=_liberar)
+    except Exception:
+        _liberar()
+        raise
+
+@app.get("/salud")
+async def salud():
+    admision: _Admision = app.state.admision
+    return {"estado": "ok", "en_curso": admision.en_curso, "en_cola": admision.en_cola,
+            "max_concurrencia": API_MAX_CONCURRENCIA, "max_en_cola": API_MAX_EN_COLA, "uso_llm": uso_llm()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return telemetry.metricas.exposicion_prometheus()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host="0.0.0.0", port=int(os.getenv("API_PORT", "8000")))
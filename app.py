@@ -2,17 +2,20 @@
 import os
 import re
 import json
+import uuid
 import streamlit as st
 import pandas as pd
 from sqlalchemy import create_engine, inspect
 
-from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
+from langchain_core.messages import HumanMessage
 from langgraph.checkpoint.memory import MemorySaver
-from langchain.prompts import ChatPromptTemplate
 
-from my_tools import toolkit, save_historical_data_to_db
+from my_tools import metricas_coalescencia
+from llm_client import obtener_llm, uso_llm
+from pipeline import crear_agente, ejecutar_consulta
+from prefetch import iniciar_prefetch
+from persistence import obtener_cola
+import telemetry
 with open("api_key.txt") as archivo:
   apikey = archivo.read()
 os.environ["OPENAI_API_KEY"] = apikey 
@@ -40,29 +43,45 @@ def load_openai_key():
 
 os.environ["OPENAI_API_KEY"] = load_openai_key()
 
+# ─── 2b. Prefetch en segundo plano de la watchlist ────────────────────────────
+@st.cache_resource
+def _arrancar_prefetch():
+    # st.cache_resource garantiza un único hilo por proceso aunque Streamlit re-ejecute el script
+    return iniciar_prefetch()
+
+_arrancar_prefetch()
+
+@st.cache_resource
+def _arrancar_metricas():
+    # Endpoint Prometheus opcional, uno por proceso
+    if telemetry.METRICS_PORT:
+        return telemetry.iniciar_servidor_metricas(int(telemetry.METRICS_PORT))
+
+_arrancar_metricas()
+
 # ─── 3. Inicialización del LLM y del agente ───────────────────────────────────
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-try:
+@st.cache_resource
+def _crear_agente():
+    # Un único LLM (pool de conexiones y límite de concurrencia compartidos) y un único
+    # agente por proceso; la prueba de conexión se hace solo al crearlos, no en cada rerun
+    llm = obtener_llm()
     _ = llm.invoke([HumanMessage(content="Hola")], timeout=10)
+    return crear_agente(llm, checkpointer=MemorySaver())
+
+try:
+    agent = _crear_agente()
     st.sidebar.success("✅ Conexión con OpenAI OK")
 except Exception as e:
     st.sidebar.error("❌ Falló conexión con OpenAI")
     st.sidebar.exception(e)
     st.stop()
 
-memory = MemorySaver()
-prompt = ChatPromptTemplate.from_messages([
-    ("system", """
-Eres un asistente experto en análisis financiero, criptomonedas y mercados bursátiles.
-Usa las herramientas disponibles y responde de forma clara y concisa.
-"""),
-    ("human", "{messages}")
-])
-agent = create_react_agent(llm, toolkit, checkpointer=memory, prompt=prompt)
-
 # ─── 4. Estado de la conversación ──────────────────────────────────────────────
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "thread_id" not in st.session_state:
+    # El agente es compartido: cada sesión del navegador usa su propio hilo de memoria
+    st.session_state.thread_id = f"chat-{uuid.uuid4().hex[:8]}"
 
 def add_message(role: str, content: str):
     st.session_state.chat_history.append({"role": role, "content": content})
@@ -70,28 +89,9 @@ def add_message(role: str, content: str):
 # ─── 5. Procesamiento de la consulta ───────────────────────────────────────────
 def process_query(query: str):
     add_message("user", query)
-    final_text = ""
-    images: list[str] = []
-    tool_outputs: list[str] = []
-
-    for step in agent.stream(
-        {"messages": [HumanMessage(content=query)]},
-        config={"configurable": {"thread_id": "chat1"}}
-    ):
-        # Capturar salidas de herramientas
-        for msg in step.get("tools", {}).get("messages", []):
-            if isinstance(msg, ToolMessage):
-                text = msg.content.strip()
-                tool_outputs.append(text)
-                if text.lower().endswith(".png") and os.path.exists(text):
-                    images.append(text)
-
-        # Capturar la respuesta final del agente
-        for msg in reversed(step.get("agent", {}).get("messages", [])):
-            if isinstance(msg, AIMessage) and msg.content:
-                final_text = msg.content
-                break
-
+    with telemetry.turno() as spans:
+        final_text, images, tool_outputs = ejecutar_consulta(agent, query, thread_id=st.session_state.thread_id)
+    st.session_state.ultimo_turno = telemetry.resumen_turno(spans)
     add_message("assistant", final_text or "⚠️ No se obtuvo respuesta.")
     return final_text, images, tool_outputs
 
@@ -133,8 +133,9 @@ if user_query := st.chat_input("¿Qué quieres consultar hoy?"):
                 records = json.loads(out)
                 ticker = extract_ticker(user_query)
                 if ticker and isinstance(records, list):
-                    msg = save_historical_data_to_db(ticker, records)
-                    st.success(f"📦 Persistencia automática: {msg}")
+                    # La escritura ocurre en segundo plano; el estado se muestra en la barra lateral
+                    encolados = obtener_cola().encolar(ticker, records)
+                    st.success(f"📦 Persistencia automática: {encolados} registros de '{ticker}' encolados.")
                     persisted = True
                 else:
                     st.info("⚠️ Datos históricos detectados, pero no pude extraer el ticker.")
@@ -155,6 +156,19 @@ for msg in st.session_state.chat_history:
     st.chat_message(msg["role"]).write(msg["content"])
 
 # ─── 8. Panel de administración ────────────────────────────────────────────────
+@st.fragment(run_every="2s")
+def estado_persistencia():
+    # Se refresca solo, sin re-ejecutar el script, mientras la cola escribe en segundo plano
+    estado = obtener_cola().estado()
+    st.markdown("**💾 Persistencia en segundo plano**")
+    st.caption(f"Pendientes: {estado['pendientes']} · Escritas: {estado['escritas']} · "
+               f"Sin cambios: {estado['omitidas']} · Errores: {estado['errores']}")
+    if estado["ultimo_resultado"]:
+        st.caption(f"{estado['ultima_escritura'] or ''} {estado['ultimo_resultado']}")
+
+with st.sidebar:
+    estado_persistencia()
+
 with st.sidebar.expander("⚙️ Ver datos históricos guardados"):
     engine = create_engine(HIST_DB_URI)
     inspector = inspect(engine)
@@ -169,5 +183,17 @@ with st.sidebar.expander("⚙️ Ver datos históricos guardados"):
     else:
         st.warning("La tabla `historical_prices` no existe.")
 
+with st.sidebar.expander("⏱️ Desglose del último turno"):
+    if st.session_state.get("ultimo_turno"):
+        st.dataframe(pd.DataFrame(st.session_state.ultimo_turno).round({"ms": 1}), hide_index=True)
+    else:
+        st.caption("Aún no se ha procesado ninguna consulta.")
+
+with st.sidebar.expander("📡 Llamadas a APIs externas"):
+    st.caption("Llamadas concurrentes idénticas que compartieron una única descarga.")
+    st.dataframe(pd.DataFrame(metricas_coalescencia()).T)
+    st.caption("Uso acumulado del LLM por modelo (llamadas, tokens y espera por el límite de concurrencia).")
+    st.dataframe(pd.DataFrame(uso_llm()).T)
+
 st.markdown("---")
 st.caption("💾 Los datos históricos se guardan automáticamente cuando se detecta un JSON de precios.")
@@ -0,0 +1,129 @@
+# batch.py
+"""
+Ejecución por lotes de consultas desde un archivo JSONL, sin interfaz.
+
+Cada línea de entrada es un objeto JSON con la consulta en "consulta" (o "query")
+y, opcionalmente, un "id". Las consultas se reparten entre un pool de workers que
+comparten un único agente, los límites globales de tasa hacia OpenAI, Yahoo Finance
+y CoinGecko, y la caché de históricos con coalescencia de my_tools.py: si cien
+consultas piden BTC-USD, el histórico se descarga una sola vez.
+
+Cada resultado (respuesta, gráficos, tiempos) se escribe en el JSONL de salida en
+cuanto termina, así que un informe nocturno largo puede seguirse con `tail -f`.
+
+Uso:
+    python batch.py consultas.jsonl resultados.jsonl --workers 8 --openai-rps 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+import matplotlib
+matplotlib.use("Agg")  # sin display: los gráficos solo se escriben a archivo
+
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+import my_tools
+import telemetry
+from agents import get_shared_llm
+from llm_client import cargar_openai_key, uso_llm
+from pipeline import crear_agente, ejecutar_consulta
+
+def leer_consultas(ruta: str) -> List[Dict[str, str]]:
+    """Lee el JSONL de entrada; las líneas vacías se ignoran y las inválidas abortan con el número de línea."""
+    consultas = []
+    with open(ruta, encoding="utf-8") as f:
+        for numero, linea in enumerate(f, start=1):
+            if not linea.strip():
+                continue
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Línea {numero} de {ruta} no es JSON válido: {e}") from e
+            if not isinstance(registro, dict):
+                raise ValueError(f"Línea {numero} de {ruta} no es un objeto JSON.")
+            texto = registro.get("consulta") or registro.get("query")
+            if not texto:
+                raise ValueError(f"Línea {numero} de {ruta} no tiene campo 'consulta' ni 'query'.")
+            consultas.append({"id": str(registro.get("id", numero)), "consulta": texto})
+    return consultas
+
+def _procesar(agente, consulta: Dict[str, str]) -> Dict:
+    """Ejecuta una consulta en su propio thread de conversación y devuelve el registro de resultado."""
+    thread_id = f"batch-{consulta['id']}-{uuid.uuid4().hex[:8]}"
+    inicio = time.perf_counter()
+    resultado = {"id": consulta["id"], "consulta": consulta["consulta"], "thread_id": thread_id}
+    try:
+        with telemetry.turno("batch") as spans:
+            respuesta, imagenes, salidas = ejecutar_consulta(agente, consulta["consulta"], thread_id=thread_id)
+        resultado.update({
+            "respuesta": respuesta,
+            "imagenes": [os.path.abspath(img) for img in imagenes],
+            "errores_herramientas": [s for s in salidas if "error" in s.lower()],
+            "desglose": telemetry.resumen_turno(spans),
+            "error": None,
+        })
+    except Exception as e:
+        resultado["error"] = f"{type(e).__name__}: {e}"
+    resultado["duracion_seg"] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Ejecuta un JSONL de consultas contra el asistente financiero.")
+    parser.add_argument("entrada", help="JSONL con una consulta por línea.")
+    parser.add_argument("salida", help="JSONL donde se escribe un resultado por línea según terminan.")
+    parser.add_argument("--workers", type=int, default=4, help="Consultas ejecutadas en paralelo.")
+    parser.add_argument("--openai-rps", type=float, default=2.0, help="Peticiones por segundo máximas a OpenAI.")
+    parser.add_argument("--yahoo-por-minuto", type=float, default=None,
+                        help="Límite global de llamadas a Yahoo Finance (por defecto el de my_tools).")
+    parser.add_argument("--coingecko-por-minuto", type=float, default=None,
+                        help="Límite global de llamadas a CoinGecko (por defecto el de my_tools).")
+    parser.add_argument("--ttl-cache", type=float, default=6 * 3600,
+                        help="Vida de la caché de históricos durante el lote, para reutilizar descargas entre consultas.")
+    args = parser.parse_args(argv)
+
+    consultas = leer_consultas(args.entrada)
+    if not consultas:
+        print(f"No hay consultas en {args.entrada}.")
+        return 0
+
+    cargar_openai_key()
+
+    my_tools.HISTORIAL_TTL_SEG = args.ttl_cache
+    my_tools.configurar_limites(args.yahoo_por_minuto, args.coingecko_por_minuto)
+    limitador_openai = InMemoryRateLimiter(requests_per_second=args.openai_rps,
+                                           check_every_n_seconds=0.05,
+                                           max_bucket_size=max(1, args.workers))
+    agente = crear_agente(get_shared_llm(rate_limiter=limitador_openai))
+
+    inicio = time.perf_counter()
+    completadas, fallidas = 0, 0
+    with open(args.salida, "w", encoding="utf-8") as salida, \
+            ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futuros = [executor.submit(_procesar, agente, c) for c in consultas]
+        for futuro in as_completed(futuros):
+            resultado = futuro.result()
+            # Solo el hilo principal escribe: cada resultado se vuelca en cuanto termina
+            salida.write(json.dumps(resultado, ensure_ascii=False, default=str) + "\n")
+            salida.flush()
+            completadas += 1
+            fallidas += 1 if resultado["error"] else 0
+            print(f"[{completadas}/{len(consultas)}] {resultado['id']}: "
+                  f"{'ERROR' if resultado['error'] else 'ok'} ({resultado['duracion_seg']}s)")
+
+    total = time.perf_counter() - inicio
+    print(f"\nLote terminado: {completadas} consultas ({fallidas} con error) en {total:.1f}s "
+          f"-> {completadas / total:.2f} consultas/s.")
+    print(f"Caché de históricos: {my_tools.metricas_cache()}")
+    print(f"Coalescencia de descargas: {my_tools.metricas_coalescencia()}")
+    print(f"Uso del LLM: {uso_llm()}")
+    return 1 if fallidas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,8 @@
+# benchmarks/__init__.py
+"""
+Benchmarks offline del asistente financiero.
+
+Todo se ejecuta contra sustitutos locales y deterministas de Yahoo Finance,
+CoinGecko, PostgreSQL y OpenAI (ver benchmarks/fakes.py), de modo que los
+resultados son comparables entre ejecuciones y no requieren red ni claves.
+"""
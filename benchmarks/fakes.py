@@ -0,0 +1,427 @@
+# benchmarks/fakes.py
+"""
+Sustitutos locales y deterministas de los servicios externos del asistente:
+
+- ServidorGrabado: servidor HTTP local que reproduce respuestas de CoinGecko, grabadas
+  en benchmarks/grabaciones/ (ver grabar_respuestas) o sintéticas si no hay grabación.
+- YFinanceSintetico: reemplazo del módulo yfinance con series OHLCV sintéticas.
+- PoolSQLite: sustituto embebido de psycopg2.pool.SimpleConnectionPool sobre SQLite.
+  Para medir contra un PostgreSQL real, pasa db_uri a entorno_simulado.
+- ChatModelGuionizado: modelo de chat que llama a las herramientas según un guion fijo.
+
+entorno_simulado() instala todos ellos en my_tools y los retira al salir.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from psycopg2.pool import PoolError
+
+DIRECTORIO_GRABACIONES = os.path.join(os.path.dirname(__file__), "grabaciones")
+
+def _semilla(*partes) -> int:
+    """Semilla determinista a partir de cualquier combinación de valores."""
+    return zlib.crc32("|".join(str(p) for p in partes).encode())
+
+# --- CoinGecko: servidor de respuestas grabadas ---
+
+# Como la API real: datos horarios hasta 90 días de rango, diarios por encima
+_SEGUNDOS_RANGO_HORARIO = 90 * 86400
+
+def _market_chart_sintetico(coin_id: str, desde: int, hasta: int) -> dict:
+    """Genera una respuesta de /market_chart/range entre 'desde' y 'hasta' con la granularidad de CoinGecko."""
+    paso = 3600 if hasta - desde <= _SEGUNDOS_RANGO_HORARIO else 86400
+    inicio = desde - desde % paso + paso
+    ts = np.arange(inicio, hasta + 1, paso, dtype=np.int64)
+    # El precio depende solo del instante, así que bloques solapados devuelven los mismos valores
+    base = 100 + _semilla(coin_id) % 50_000
+    precios = base * (1 + 0.1 * np.sin(ts / 86400 / 30) + 0.01 * np.sin(ts / 3600))
+    volumenes = base * 1e4 * (1.5 + np.cos(ts / 86400 / 7))
+    ms = (ts * 1000).tolist()
+    return {
+        "prices": [list(p) for p in zip(ms, precios.tolist())],
+        "market_caps": [list(p) for p in zip(ms, (precios * 1e7).tolist())],
+        "total_volumes": [list(p) for p in zip(ms, volumenes.tolist())],
+    }
+
+def _info_sintetica(coin_id: str) -> dict:
+    return {
+        "name": coin_id.capitalize(),
+        "description": {"en": f"{coin_id} es una criptomoneda sintética usada en benchmarks. " * 20},
+        "genesis_date": "2015-07-30",
+        "last_updated": "2024-12-31T00:00:00.000Z",
+    }
+
+
+class ServidorGrabado:
+    """
+    Servidor HTTP local con la misma forma de API que CoinGecko (/coins/{id} y
+    /coins/{id}/market_chart/range). Si existe benchmarks/grabaciones/<id>.json se
+    sirven sus puntos filtrados por rango; si no, se generan de forma determinista.
+    """
+
+    def __init__(self, latencia_seg: float = 0.0, directorio: str = DIRECTORIO_GRABACIONES):
+        self.latencia_seg = latencia_seg
+        self.directorio = directorio
+        self.peticiones = 0
+        self._grabaciones: Dict[str, dict] = {}
+        self._servidor: Optional[ThreadingHTTPServer] = None
+
+    def _grabacion(self, coin_id: str) -> Optional[dict]:
+        if coin_id not in self._grabaciones:
+            ruta = os.path.join(self.directorio, f"{coin_id}.json")
+            self._grabaciones[coin_id] = None
+            if os.path.exists(ruta):
+                with open(ruta, encoding="utf-8") as f:
+                    self._grabaciones[coin_id] = json.load(f)
+        return self._grabaciones[coin_id]
+
+    def responder(self, ruta: str, query: Dict[str, List[str]]):
+        """Devuelve (código, cuerpo) para una petición a la API simulada."""
+        partes = [p for p in ruta.split("/") if p]
+        if len(partes) >= 3 and partes[-2:] == ["market_chart", "range"]:
+            coin_id = partes[-3]
+            desde, hasta = int(float(query["from"][0])), int(float(query["to"][0]))
+            grabacion = self._grabacion(coin_id)
+            if grabacion is None:
+                return 200, _market_chart_sintetico(coin_id, desde, hasta)
+            diario = hasta - desde > _SEGUNDOS_RANGO_HORARIO
+            respuesta = {}
+            for clave, puntos in grabacion.items():
+                en_rango = [p for p in puntos if desde * 1000 <= p[0] <= hasta * 1000]
+                if diario:
+                    # Un punto por día UTC, como devuelve la API en rangos largos
+                    por_dia = {}
+                    for p in en_rango:
+                        por_dia.setdefault(p[0] // 86_400_000, p)
+                    en_rango = list(por_dia.values())
+                respuesta[clave] = en_rango
+            return 200, respuesta
+        if len(partes) >= 2 and partes[-2] == "coins":
+            return 200, _info_sintetica(partes[-1])
+        return 404, {"error": "ruta no soportada por el servidor de benchmarks"}
+
+    def iniciar(self) -> str:
+        """Arranca el servidor en un puerto libre y devuelve su URL base."""
+        servidor_grabado = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+            def do_GET(self):
+                servidor_grabado.peticiones += 1
+                if servidor_grabado.latencia_seg:
+                    time.sleep(servidor_grabado.latencia_seg)
+                url = urlparse(self.path)
+                codigo, cuerpo = servidor_grabado.responder(url.path, parse_qs(url.query))
+                datos = json.dumps(cuerpo).encode()
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(datos)))
+                self.end_headers()
+                self.wfile.write(datos)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._servidor.daemon_threads = True
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    def detener(self):
+        if self._servidor is not None:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+def grabar_respuestas(coin_ids: List[str], dias: int = 365, directorio: str = DIRECTORIO_GRABACIONES):
+    """
+    Graba desde la API real de CoinGecko las respuestas de market_chart/range que luego
+    reproduce ServidorGrabado. Es el único paso que necesita red.
+    """
+    import requests
+
+    os.makedirs(directorio, exist_ok=True)
+    hasta = int(time.time())
+    desde = hasta - dias * 86400
+    for coin_id in coin_ids:
+        # Bloques de 90 días para conservar la granularidad horaria; el servidor la reduce a diaria en rangos largos
+        grabacion = {"prices": [], "market_caps": [], "total_volumes": []}
+        for inicio in range(desde, hasta, 90 * 86400):
+            r = requests.get(
+                f"https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart/range",
+                params={"vs_currency": "usd", "from": inicio, "to": min(inicio + 90 * 86400 - 1, hasta)},
+                timeout=30,
+            )
+            r.raise_for_status()
+            for clave, puntos in r.json().items():
+                grabacion[clave].extend(puntos)
+            time.sleep(2.5)  # respetar el límite de la API pública
+        with open(os.path.join(directorio, f"{coin_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(grabacion, f)
+        print(f"Grabado {coin_id}: {len(grabacion['prices'])} puntos.")
+
+# --- Yahoo Finance: proveedor sintético ---
+
+def serie_sintetica(ticker: str, filas: int) -> pd.DataFrame:
+    """Histórico OHLCV diario determinista con la misma forma que yf.Ticker(...).history()."""
+    rng = np.random.default_rng(_semilla(ticker))
+    fechas = pd.date_range(end="2024-12-31", periods=filas, freq="D", tz="America/New_York", name="Date")
+    cierre = (50 + _semilla(ticker) % 500) * np.exp(np.cumsum(rng.normal(0, 0.02, filas)))
+    apertura = cierre * (1 + rng.normal(0, 0.005, filas))
+    return pd.DataFrame({
+        "Open": apertura,
+        "High": np.maximum(apertura, cierre) * (1 + rng.uniform(0, 0.01, filas)),
+        "Low": np.minimum(apertura, cierre) * (1 - rng.uniform(0, 0.01, filas)),
+        "Close": cierre,
+        "Volume": rng.integers(1_000_000, 50_000_000, filas),
+        "Dividends": 0.0,
+        "Stock Splits": 0.0,
+    }, index=fechas)
+
+
+class _TickerSintetico:
+    def __init__(self, proveedor: "YFinanceSintetico", ticker: str):
+        self._proveedor = proveedor
+        self.ticker = ticker
+
+    def history(self, period: str = "max", **kwargs) -> pd.DataFrame:
+        self._proveedor.llamadas += 1
+        if self._proveedor.latencia_seg:
+            time.sleep(self._proveedor.latencia_seg)
+        return serie_sintetica(self.ticker, self._proveedor.filas)
+
+    @property
+    def info(self) -> dict:
+        self._proveedor.llamadas += 1
+        if self._proveedor.latencia_seg:
+            time.sleep(self._proveedor.latencia_seg)
+        return {"shortName": self.ticker, "longBusinessSummary": f"Activo sintético {self.ticker}. " * 40}
+
+
+class YFinanceSintetico:
+    """Sustituto del módulo yfinance: solo implementa lo que usa my_tools (Ticker().history / .info)."""
+
+    def __init__(self, filas: int = 3000, latencia_seg: float = 0.0):
+        self.filas = filas
+        self.latencia_seg = latencia_seg
+        self.llamadas = 0
+
+    def Ticker(self, ticker: str) -> _TickerSintetico:
+        return _TickerSintetico(self, ticker)
+
+# --- PostgreSQL: sustituto embebido sobre SQLite ---
+
+_TRADUCCIONES_SQL = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\bSERIAL PRIMARY KEY\b", re.IGNORECASE), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    (re.compile(r"CURRENT_DATE\s*-\s*\?", re.IGNORECASE), "date('now', '-' || ? || ' days')"),
+]
+
+def _traducir_sql(sql: str) -> str:
+    """Adapta el dialecto PostgreSQL usado por my_tools al de SQLite."""
+    for patron, reemplazo in _TRADUCCIONES_SQL:
+        sql = patron.sub(reemplazo, sql)
+    return sql
+
+
+class _CursorSQLite:
+    def __init__(self, conn: sqlite3.Connection):
+        self._cur = conn.cursor()
+        self.itersize = 2000
+
+    def execute(self, sql, params=None):
+        self._cur.execute(_traducir_sql(sql), tuple(params or ()))
+
+    def executemany(self, sql, params_seq):
+        self._cur.executemany(_traducir_sql(sql), [tuple(p) for p in params_seq])
+
+    def fetchone(self):
+        return self._cur.fetchone()
+
+    def fetchall(self):
+        return self._cur.fetchall()
+
+    def fetchmany(self, size=None):
+        return self._cur.fetchmany(size or self.itersize)
+
+    @property
+    def rowcount(self):
+        return self._cur.rowcount
+
+    def close(self):
+        self._cur.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _ConexionSQLite:
+    def __init__(self, ruta: str):
+        self._conn = sqlite3.connect(ruta, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+    def cursor(self, name: str = None):
+        # Los cursores con nombre (de servidor) de psycopg2 se emulan con cursores normales
+        return _CursorSQLite(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class PoolSQLite:
+    """
+    Sustituto de psycopg2.pool.SimpleConnectionPool sobre un archivo SQLite temporal.
+    Mantiene los atributos _used/_pool y el error PoolError del original para que las
+    métricas de saturación del pool sean comparables.
+    """
+
+    def __init__(self, maxconn: int = 20, ruta: str = None):
+        self.maxconn = maxconn
+        self.ruta = ruta or os.path.join(tempfile.mkdtemp(prefix="bench_db_"), "historico.sqlite")
+        self._lock = threading.Lock()
+        self._pool: List[_ConexionSQLite] = []
+        self._used: Dict[int, _ConexionSQLite] = {}
+
+    def getconn(self):
+        with self._lock:
+            if len(self._used) >= self.maxconn:
+                raise PoolError("connection pool exhausted")
+            conn = self._pool.pop() if self._pool else _ConexionSQLite(self.ruta)
+            self._used[id(conn)] = conn
+            return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            self._used.pop(id(conn), None)
+            self._pool.append(conn)
+
+    def closeall(self):
+        with self._lock:
+            for conn in self._pool + list(self._used.values()):
+                conn.close()
+            self._pool, self._used = [], {}
+
+# --- OpenAI: modelo de chat guionizado ---
+
+class ChatModelGuionizado(BaseChatModel):
+    """
+    Modelo de chat determinista para benchmarks. 'guiones' asocia el texto de una consulta
+    a las llamadas de herramienta que debe emitir ({"name": ..., "args": {...}}).
+    En el primer turno emite todas las llamadas del guion; cuando ya hay resultados de
+    herramientas en la conversación, devuelve la respuesta final.
+    """
+
+    guiones: Dict[str, List[Dict[str, Any]]] = {}
+    latencia_seg: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "guionizado"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latencia_seg:
+            time.sleep(self.latencia_seg)
+
+        # El prompt de la app serializa el historial en un único mensaje humano,
+        # así que los resultados de herramientas pueden llegar como texto.
+        texto = "\n".join(str(m.content) for m in messages)
+        hay_resultados = any(isinstance(m, ToolMessage) for m in messages) or "ToolMessage(" in texto
+        consulta = next((c for c in self.guiones if c in texto), None)
+
+        if consulta is None or hay_resultados:
+            mensaje = AIMessage(content=f"Respuesta simulada ({len(texto)} caracteres de contexto).")
+        else:
+            mensaje = AIMessage(content="", tool_calls=[
+                {"name": llamada["name"], "args": llamada["args"], "id": f"call_{i}", "type": "tool_call"}
+                for i, llamada in enumerate(self.guiones[consulta])
+            ])
+
+        tokens_entrada = len(texto) // 4
+        tokens_salida = len(str(mensaje.content)) // 4 + 10 * len(mensaje.tool_calls)
+        mensaje.usage_metadata = {
+            "input_tokens": tokens_entrada,
+            "output_tokens": tokens_salida,
+            "total_tokens": tokens_entrada + tokens_salida,
+        }
+        return ChatResult(generations=[ChatGeneration(message=mensaje)])
+
+# --- Instalación en my_tools ---
+
+@contextmanager
+def entorno_simulado(filas_yahoo: int = 3000,
+                     latencia_yahoo_seg: float = 0.0,
+                     latencia_http_seg: float = 0.0,
+                     db_uri: Optional[str] = None,
+                     max_conexiones_db: int = 20):
+    """
+    Sustituye en my_tools Yahoo Finance, CoinGecko y la base de datos por sus versiones
+    locales, desactiva los limitadores de tasa y vacía la caché de históricos.
+    Si se indica db_uri se usa ese PostgreSQL (por ejemplo uno local) en lugar de SQLite.
+
+    Yields:
+        dict: Los sustitutos instalados ("yahoo", "coingecko", "db_pool").
+    """
+    import my_tools
+
+    servidor = ServidorGrabado(latencia_seg=latencia_http_seg)
+    yahoo = YFinanceSintetico(filas=filas_yahoo, latencia_seg=latencia_yahoo_seg)
+    originales = {
+        "yf": my_tools.yf,
+        "BASE_URL_COINGECKO": my_tools.BASE_URL_COINGECKO,
+        "_limitadores": my_tools._limitadores,
+        "_db_pool": my_tools._db_pool,
+        "DB_URI": my_tools.DB_URI,
+    }
+
+    my_tools.yf = yahoo
+    my_tools.BASE_URL_COINGECKO = servidor.iniciar()
+    my_tools._limitadores = {nombre: my_tools.LimitadorTasa(0) for nombre in originales["_limitadores"]}
+    if db_uri:
+        my_tools.DB_URI = db_uri
+        my_tools._db_pool = None  # se inicializa bajo demanda contra db_uri
+    else:
+        my_tools._db_pool = PoolSQLite(maxconn=max_conexiones_db)
+    my_tools._historial_cache.clear()
+
+    try:
+        yield {"yahoo": yahoo, "coingecko": servidor, "db_pool": my_tools._db_pool}
+    finally:
+        servidor.detener()
+        if my_tools._db_pool is not None:
+            my_tools._db_pool.closeall()
+        my_tools._historial_cache.clear()
+        for nombre, valor in originales.items():
+            setattr(my_tools, nombre, valor)
+
+if __name__ == "__main__":
+    # python -m benchmarks.fakes bitcoin ethereum  -> graba respuestas reales de CoinGecko
+    import sys
+    grabar_respuestas(sys.argv[1:] or ["bitcoin", "ethereum"])
@@ -0,0 +1,195 @@
+# benchmarks/load.py
+"""
+Prueba de carga del pipeline de chat con sesiones concurrentes simuladas.
+
+Cada sesión es un hilo que lanza consultas en bucle cerrado contra el mismo agente
+(como ocurre con varias pestañas de Streamlit en un único proceso de app.py), usando
+el modelo guionizado y los sustitutos de datos de benchmarks/fakes.py con latencias
+configurables. Para cada nivel de concurrencia informa:
+    - throughput (consultas/s) y latencias p50/p95/p99,
+    - tasa de errores (incluidas respuestas de herramientas con "Error") y errores de la
+      cola de persistencia en segundo plano,
+    - pico de conexiones en uso del pool de base de datos y agotamientos del pool,
+    - memoria residente del proceso.
+
+Uso:
+    python -m benchmarks.load --concurrencias 1,4,16,32 --consultas-por-sesion 5
+    python -m benchmarks.load --thread-compartido   # todas las sesiones en el thread "chat1" (como app.py antes de usar un hilo por sesión)
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import matplotlib
+matplotlib.use("Agg")
+
+import my_tools
+from persistence import obtener_cola
+from pipeline import crear_agente, ejecutar_consulta
+from benchmarks.fakes import ChatModelGuionizado, entorno_simulado
+from benchmarks.run import ESCENARIOS
+
+def _percentil(valores: List[float], p: float) -> float:
+    """Percentil por el método del rango más cercano (valores ya medidos, sin interpolar)."""
+    if not valores:
+        return float("nan")
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+def _rss_mb() -> float:
+    """Memoria residente actual en MB (pico del proceso si /proc no está disponible)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+class _MonitorPool(threading.Thread):
+    """Muestrea periódicamente cuántas conexiones del pool de my_tools están en uso."""
+
+    def __init__(self, intervalo_seg: float = 0.005):
+        super().__init__(daemon=True)
+        self.intervalo_seg = intervalo_seg
+        self.pico = 0
+        self._detener = threading.Event()
+
+    def run(self):
+        while not self._detener.is_set():
+            pool = my_tools._db_pool
+            if pool is not None:
+                self.pico = max(self.pico, len(getattr(pool, "_used", {})))
+            self._detener.wait(self.intervalo_seg)
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+def _persistir_como_app(consulta: str, tool_outputs: List[str]):
+    """Reproduce la persistencia automática de app.py: los arrays JSON de precios se encolan para guardarse."""
+    for out in tool_outputs:
+        if out.startswith("[") and out.endswith("]"):
+            registros = json.loads(out)
+            if registros and isinstance(registros[0], dict) and "Date" in registros[0]:
+                obtener_cola().encolar("LOAD-TEST", registros)
+
+def ejecutar_nivel(agente, concurrencia: int, consultas_por_sesion: int,
+                   thread_compartido: bool, persistir: bool) -> Dict[str, float]:
+    """Lanza 'concurrencia' sesiones simultáneas y devuelve las métricas agregadas del nivel."""
+    consultas = list(ESCENARIOS)
+    latencias: List[float] = []
+    errores: List[str] = []
+    lock = threading.Lock()
+
+    def _sesion(numero: int):
+        thread_id = "chat1" if thread_compartido else f"sesion-{concurrencia}-{numero}"
+        for i in range(consultas_por_sesion):
+            consulta = consultas[(numero + i) % len(consultas)]
+            inicio = time.perf_counter()
+            error = None
+            try:
+                _, _, tool_outputs = ejecutar_consulta(agente, consulta, thread_id=thread_id)
+                fallidas = [o for o in tool_outputs if '"error"' in o.lower() or o.startswith("Error")]
+                if fallidas:
+                    error = fallidas[0][:200]
+                elif persistir:
+                    _persistir_como_app(consulta, tool_outputs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            duracion = time.perf_counter() - inicio
+            with lock:
+                latencias.append(duracion)
+                if error:
+                    errores.append(error)
+
+    monitor = _MonitorPool()
+    monitor.start()
+    inicio = time.perf_counter()
+    errores_persistencia = obtener_cola().estado()["errores"]
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        list(executor.map(_sesion, range(concurrencia)))
+    total_seg = time.perf_counter() - inicio
+    # La persistencia es asíncrona: se espera a que termine para medir el pool completo
+    obtener_cola().esperar_vacia()
+    monitor.detener()
+    errores_persistencia = obtener_cola().estado()["errores"] - errores_persistencia
+
+    total = len(latencias)
+    return {
+        "concurrencia": concurrencia,
+        "consultas": total,
+        "throughput_por_seg": total / total_seg,
+        "p50_ms": _percentil(latencias, 50) * 1000,
+        "p95_ms": _percentil(latencias, 95) * 1000,
+        "p99_ms": _percentil(latencias, 99) * 1000,
+        "tasa_error": len(errores) / total if total else 0.0,
+        "errores_persistencia": errores_persistencia,
+        "pool_agotado": sum("pool exhausted" in e for e in errores),
+        "pool_pico": monitor.pico,
+        "rss_mb": _rss_mb(),
+        "ejemplo_error": errores[0] if errores else "",
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga del pipeline de chat.")
+    parser.add_argument("--concurrencias", default="1,2,4,8,16,32",
+                        help="Niveles de sesiones simultáneas, separados por comas.")
+    parser.add_argument("--consultas-por-sesion", type=int, default=5)
+    parser.add_argument("--latencia-llm", type=float, default=0.3, help="Segundos por llamada al LLM simulado.")
+    parser.add_argument("--latencia-yahoo", type=float, default=0.05)
+    parser.add_argument("--latencia-http", type=float, default=0.02)
+    parser.add_argument("--max-conexiones-db", type=int, default=20)
+    parser.add_argument("--thread-compartido", action="store_true",
+                        help="Usa el mismo thread_id para todas las sesiones (memoria de conversación compartida).")
+    parser.add_argument("--sin-persistencia", action="store_true",
+                        help="No reproduce la persistencia automática de app.py tras cada consulta.")
+    parser.add_argument("--db-uri", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--salida", help="Ruta opcional donde guardar los resultados en JSON.")
+    args = parser.parse_args(argv)
+
+    niveles = [int(c) for c in args.concurrencias.split(",") if c.strip()]
+    resultados = []
+
+    with entorno_simulado(latencia_yahoo_seg=args.latencia_yahoo,
+                          latencia_http_seg=args.latencia_http,
+                          db_uri=args.db_uri,
+                          max_conexiones_db=args.max_conexiones_db), tempfile.TemporaryDirectory() as tmp:
+        directorio_original = os.getcwd()
+        os.chdir(tmp)
+        try:
+            agente = crear_agente(ChatModelGuionizado(guiones=ESCENARIOS, latencia_seg=args.latencia_llm))
+            print(f"{'sesiones':>9}{'consultas':>10}{'cons/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+                  f"{'errores':>9}{'pool pico':>11}{'RSS MB':>9}")
+            for concurrencia in niveles:
+                # Cada nivel empieza con la caché fría para que todas las sesiones salgan a las fuentes
+                my_tools._historial_cache.clear()
+                r = ejecutar_nivel(agente, concurrencia, args.consultas_por_sesion,
+                                   args.thread_compartido, not args.sin_persistencia)
+                resultados.append(r)
+                print(f"{r['concurrencia']:>9}{r['consultas']:>10}{r['throughput_por_seg']:>9.2f}"
+                      f"{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}{r['p99_ms']:>10.0f}"
+                      f"{r['tasa_error']:>9.1%}{r['pool_pico']:>7}/{args.max_conexiones_db:<3}{r['rss_mb']:>9.0f}")
+                if r["ejemplo_error"]:
+                    print(f"           ejemplo de error: {r['ejemplo_error']}")
+                if r["errores_persistencia"]:
+                    print(f"           errores de persistencia: {r['errores_persistencia']} ({obtener_cola().estado()['ultimo_resultado']})")
+        finally:
+            os.chdir(directorio_original)
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
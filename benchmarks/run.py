@@ -0,0 +1,171 @@
+# benchmarks/run.py
+"""
+Benchmark offline del asistente financiero.
+
+Mide, contra los sustitutos locales de benchmarks/fakes.py:
+    - latencia de cada herramienta de datos (con la caché de históricos vacía),
+    - filas por segundo de ingesta en la base de datos,
+    - tiempo de renderizado de gráficos,
+    - latencia end-to-end de una consulta completa (pipeline.ejecutar_consulta).
+
+Compara los resultados con benchmarks/baseline.json y termina con código 1 si alguna
+métrica empeora más de la tolerancia indicada.
+
+Uso:
+    python -m benchmarks.run                        # medir y comparar con la baseline
+    python -m benchmarks.run --actualizar-baseline  # medir y guardar como nueva baseline
+    python -m benchmarks.run --db-uri postgresql://localhost/bench  # PostgreSQL local en vez de SQLite
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict
+
+import matplotlib
+matplotlib.use("Agg")  # sin display: el benchmark mide solo el renderizado a archivo
+
+import my_tools
+from pipeline import crear_agente, ejecutar_consulta
+from benchmarks.fakes import ChatModelGuionizado, entorno_simulado, serie_sintetica
+
+RUTA_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# Consultas end-to-end y las herramientas que el modelo guionizado llamará para cada una
+ESCENARIOS = {
+    "Dame el histórico de AAPL de los últimos 30 días": [
+        {"name": "obtener_historico_precios", "args": {"ticker": "AAPL", "dias": 30}},
+    ],
+    "Compara bitcoin de los últimos 180 días con su información general": [
+        {"name": "obtener_historico_precios_coingecko", "args": {"coin_id": "bitcoin", "dias": 180}},
+        {"name": "obtener_info_cripto", "args": {"coin_id": "bitcoin"}},
+    ],
+    "Grafica el cierre de BTC-USD de los últimos 365 días": [
+        {"name": "obtener_y_graficar", "args": {"ticker": "BTC-USD", "dias": 365, "columna": "Close"}},
+    ],
+}
+
+FILAS_INGESTA = 5000
+
+def _mediana(funcion: Callable[[], None], repeticiones: int, preparar: Callable[[], None] = None) -> float:
+    """Mediana en segundos de 'repeticiones' ejecuciones; 'preparar' se ejecuta antes de cada una sin medirse."""
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+def _registros_ingesta(n: int) -> list:
+    """Registros con el formato de obtener_historico_precios para la prueba de ingesta."""
+    df = serie_sintetica("BENCH", n).reset_index()
+    df["Date"] = df["Date"].dt.strftime('%Y-%m-%d')
+    df["Volume"] = df["Volume"].astype(int)
+    return df[["Date", "Open", "High", "Low", "Close", "Volume"]].to_dict(orient="records")
+
+def ejecutar_benchmarks(repeticiones: int = 5, db_uri: str = None) -> Dict[str, float]:
+    """Ejecuta todas las mediciones y devuelve {métrica: valor}. Las métricas *_por_seg son 'más es mejor'."""
+    resultados: Dict[str, float] = {}
+    vaciar_cache = my_tools._historial_cache.clear
+
+    with entorno_simulado(db_uri=db_uri), tempfile.TemporaryDirectory() as tmp:
+        directorio_original = os.getcwd()
+        os.chdir(tmp)  # los gráficos se escriben en el directorio actual
+        try:
+            herramientas = {
+                "obtener_historico_precios": (my_tools.obtener_historico_precios_tool, {"ticker": "AAPL", "dias": 365}),
+                "obtener_historico_precios_coingecko": (my_tools.obtener_historico_precios_coingecko_tool, {"coin_id": "bitcoin", "dias": 365}),
+                "obtener_info_yahoo": (my_tools.obtener_info_yahoo_tool, {"ticker": "AAPL"}),
+                "obtener_info_cripto": (my_tools.obtener_info_cripto_tool, {"coin_id": "bitcoin"}),
+            }
+            for nombre, (herramienta, args) in herramientas.items():
+                resultados[f"herramienta.{nombre}_seg"] = _mediana(
+                    lambda: herramienta.invoke(args), repeticiones, preparar=vaciar_cache)
+
+            resultados["grafico.obtener_y_graficar_seg"] = _mediana(
+                lambda: my_tools.obtener_y_graficar.invoke({"ticker": "BTC-USD", "dias": 365, "columna": "Close"}),
+                repeticiones)
+
+            registros = _registros_ingesta(FILAS_INGESTA)
+            segundos = _mediana(
+                lambda: my_tools.save_historical_data_to_db.invoke({"ticker": "BENCH", "data": registros}),
+                repeticiones)
+            resultados["db.ingesta_filas_por_seg"] = FILAS_INGESTA / segundos
+
+            agente = crear_agente(ChatModelGuionizado(guiones=ESCENARIOS))
+            for i, consulta in enumerate(ESCENARIOS):
+                resultados[f"e2e.escenario_{i + 1}_seg"] = _mediana(
+                    lambda: ejecutar_consulta(agente, consulta, thread_id=f"bench-{i}-{time.perf_counter_ns()}"),
+                    repeticiones, preparar=vaciar_cache)
+        finally:
+            os.chdir(directorio_original)
+
+    return resultados
+
+def comparar_con_baseline(resultados: Dict[str, float], baseline: Dict[str, float], tolerancia: float) -> list:
+    """Devuelve la lista de regresiones (métrica, baseline, actual) que superan la tolerancia."""
+    regresiones = []
+    for metrica, actual in resultados.items():
+        base = baseline.get(metrica)
+        if base is None:
+            continue
+        if metrica.endswith("_por_seg"):
+            empeora = actual < base / (1 + tolerancia)
+        else:
+            empeora = actual > base * (1 + tolerancia)
+        if empeora:
+            regresiones.append((metrica, base, actual))
+    return regresiones
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline del asistente financiero.")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--tolerancia", type=float, default=0.25,
+                        help="Empeoramiento relativo permitido frente a la baseline (0.25 = 25%%).")
+    parser.add_argument("--baseline", default=RUTA_BASELINE)
+    parser.add_argument("--actualizar-baseline", action="store_true")
+    parser.add_argument("--db-uri", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="PostgreSQL local a usar en lugar del sustituto SQLite.")
+    parser.add_argument("--salida", help="Ruta opcional donde guardar los resultados en JSON.")
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar_benchmarks(args.repeticiones, args.db_uri)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    print(f"{'Métrica':<55}{'Baseline':>14}{'Actual':>14}")
+    for metrica, valor in resultados.items():
+        base = f"{baseline[metrica]:.6g}" if metrica in baseline else "-"
+        print(f"{metrica:<55}{base:>14}{valor:>14.6g}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+    if args.actualizar_baseline or not baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f"\nBaseline guardada en {args.baseline}.")
+        return 0
+
+    regresiones = comparar_con_baseline(resultados, baseline, args.tolerancia)
+    if regresiones:
+        print(f"\n❌ {len(regresiones)} regresiones (tolerancia {args.tolerancia:.0%}):")
+        for metrica, base, actual in regresiones:
+            print(f"  - {metrica}: {base:.6g} -> {actual:.6g}")
+        return 1
+
+    print(f"\n✅ Sin regresiones frente a la baseline (tolerancia {args.tolerancia:.0%}).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
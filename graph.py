@@ -10,6 +10,7 @@ from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.postgres import PostgresSaver
 
 from agents import initialize_agents, get_supervisor_prompt, get_shared_llm
+from telemetry import ManejadorTelemetria, span
 
 class AgentState(TypedDict):
     messages: Annotated[List[BaseMessage], list.__add__]
@@ -18,7 +19,7 @@ class AgentState(TypedDict):
 def create_financial_assistant_graph():
     # 1) Inicializar LLM y agentes
     llm = get_shared_llm()
-    agents = initialize_agents()
+    agents = initialize_agents(llm)  # mismo cliente para supervisor y agentes
     sup_prompt = get_supervisor_prompt()
 
     # 2) Construir el grafo
@@ -36,7 +37,8 @@ def create_financial_assistant_graph():
         human_tmpl = sup_prompt.messages[1].prompt
         human_msg = HumanMessage(content=human_tmpl.format(messages=history))
 
-        res = llm.generate(messages=[sys_msg, human_msg])
+        with span("agente", "SUPERVISOR"):
+            res = llm.generate(messages=[sys_msg, human_msg], callbacks=[ManejadorTelemetria()])
         ai_msg = res.generations[0][0].message
         state["messages"].append(ai_msg)
         state["next"] = ai_msg.content.strip()
@@ -47,7 +49,8 @@ def create_financial_assistant_graph():
         def _make_node(n: str, execu):
             @graph.node(n)
             def _agent(state: AgentState) -> AgentState:
-                reply = execu.run(messages=state["messages"])
+                with span("agente", n):
+                    reply = execu.run(messages=state["messages"])
                 state["messages"].append(AIMessage(content=reply))
                 state["next"] = "SUPERVISOR"
                 return state
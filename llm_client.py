@@ -0,0 +1,292 @@
+# llm_client.py
+"""
+Cliente LLM compartido por todo el proceso (app.py, api.py, batch.py, agents.py y graph.py).
+
+obtener_llm() devuelve siempre la misma instancia para una configuración dada, y todas
+las instancias comparten:
+    - un pool de conexiones HTTP keep-alive (httpx) hacia OpenAI, síncrono y asíncrono,
+    - un límite de llamadas simultáneas al proveedor (semáforo de proceso), para que muchas
+      sesiones concurrentes esperen turno en lugar de provocar ráfagas de 429,
+    - timeout por petición y un presupuesto de reintentos común a todo el proceso: cada
+      reintento (429, timeouts, errores 5xx o de conexión) consume un token de un cubo que se
+      rellena a LLM_REINTENTOS_POR_MINUTO; con el cubo vacío el error se propaga en lugar de
+      multiplicar la carga sobre un proveedor ya saturado. Las esperas respetan Retry-After,
+    - contabilidad de uso por modelo: llamadas, tokens, errores, reintentos y tiempo de espera en el semáforo.
+
+Configuración (variables de entorno):
+    OPENAI_MODEL              Modelo por defecto (gpt-4o-mini).
+    LLM_MAX_CONCURRENCIA      Llamadas simultáneas máximas al proveedor (8).
+    LLM_TIMEOUT_SEG           Timeout de cada petición en segundos (60).
+    LLM_MAX_REINTENTOS        Reintentos máximos de una misma llamada (3).
+    LLM_REINTENTOS_POR_MINUTO Reintentos que admite el proceso entero por minuto (20).
+    LLM_MAX_CONEXIONES        Tamaño del pool de conexiones HTTP (20).
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+LLM_MAX_CONCURRENCIA = int(os.getenv("LLM_MAX_CONCURRENCIA", "8"))
+LLM_TIMEOUT_SEG = float(os.getenv("LLM_TIMEOUT_SEG", "60"))
+LLM_MAX_REINTENTOS = int(os.getenv("LLM_MAX_REINTENTOS", "3"))
+LLM_MAX_CONEXIONES = int(os.getenv("LLM_MAX_CONEXIONES", "20"))
+LLM_REINTENTOS_POR_MINUTO = float(os.getenv("LLM_REINTENTOS_POR_MINUTO", "20"))
+
+# Semáforo de hilos (no de asyncio): lo comparten los hilos de Streamlit/batch y el bucle de api.py
+_semaforo = threading.BoundedSemaphore(LLM_MAX_CONCURRENCIA)
+# Hilos dedicados a esperar el semáforo desde el bucle de eventos, sin ocupar el executor por defecto
+_esperas_async = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-turno")
+
+_ERRORES_REINTENTABLES = (openai.RateLimitError, openai.APITimeoutError,
+                          openai.APIConnectionError, openai.InternalServerError)
+
+
+class _PresupuestoReintentos:
+    """Cubo de tokens compartido por todas las instancias: cada reintento consume uno."""
+
+    def __init__(self, por_minuto: float):
+        self.capacidad = max(1.0, por_minuto)
+        self.ritmo_seg = por_minuto / 60.0
+        self._tokens = self.capacidad
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def tomar(self) -> bool:
+        with self._lock:
+            ahora = time.monotonic()
+            self._tokens = min(self.capacidad, self._tokens + (ahora - self._ultimo) * self.ritmo_seg)
+            self._ultimo = ahora
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+_presupuesto = _PresupuestoReintentos(LLM_REINTENTOS_POR_MINUTO)
+
+
+class _UsoLLM:
+    """Contadores de uso por modelo, thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_modelo: Dict[str, Dict[str, float]] = {}
+
+    def registrar(self, modelo: str, espera_seg: float, resultado=None, error: bool = False):
+        entrada, salida = _tokens(resultado)
+        with self._lock:
+            uso = self._uso(modelo)
+            uso["llamadas"] += 1
+            uso["errores"] += 1 if error else 0
+            uso["tokens_entrada"] += entrada
+            uso["tokens_salida"] += salida
+            uso["espera_seg"] += espera_seg
+
+    def registrar_reintento(self, modelo: str, concedido: bool):
+        with self._lock:
+            self._uso(modelo)["reintentos" if concedido else "reintentos_denegados"] += 1
+
+    def _uso(self, modelo: str) -> Dict[str, float]:
+        return self._por_modelo.setdefault(modelo, {
+            "llamadas": 0, "errores": 0, "reintentos": 0, "reintentos_denegados": 0,
+            "tokens_entrada": 0, "tokens_salida": 0, "espera_seg": 0.0,
+        })
+
+    def resumen(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {modelo: dict(uso) for modelo, uso in self._por_modelo.items()}
+
+def _tokens(resultado) -> tuple:
+    """Tokens de entrada y salida de un ChatResult (0, 0 si no se conocen)."""
+    if resultado is None:
+        return 0, 0
+    uso = (resultado.llm_output or {}).get("token_usage") or {}
+    if uso:
+        return uso.get("prompt_tokens") or 0, uso.get("completion_tokens") or 0
+    if resultado.generations:
+        metadatos = getattr(resultado.generations[0].message, "usage_metadata", None) or {}
+        return metadatos.get("input_tokens") or 0, metadatos.get("output_tokens") or 0
+    return 0, 0
+
+_uso = _UsoLLM()
+
+def uso_llm() -> Dict[str, Dict[str, float]]:
+    """Uso acumulado por modelo desde el arranque del proceso."""
+    return _uso.resumen()
+
+def cargar_openai_key(ruta: str = "api_key.txt") -> None:
+    """Como app.py: toma OPENAI_API_KEY del entorno o, si no está, de api_key.txt."""
+    if "OPENAI_API_KEY" not in os.environ and os.path.exists(ruta):
+        with open(ruta) as archivo:
+            os.environ["OPENAI_API_KEY"] = archivo.read().strip()
+
+
+@contextmanager
+def _turno_llm():
+    """Espera turno en el semáforo y devuelve cuánto se esperó."""
+    inicio = time.perf_counter()
+    _semaforo.acquire()
+    try:
+        yield time.perf_counter() - inicio
+    finally:
+        _semaforo.release()
+
+async def _esperar_turno_async() -> float:
+    """Espera turno sin bloquear el bucle de eventos; el llamador debe liberar _semaforo."""
+    inicio = time.perf_counter()
+    if not _semaforo.acquire(blocking=False):
+        futuro = asyncio.get_running_loop().run_in_executor(_esperas_async, _semaforo.acquire)
+        try:
+            await asyncio.shield(futuro)
+        except asyncio.CancelledError:
+            # El hilo acabará adquiriendo el turno: se devuelve en cuanto lo haga
+            futuro.add_done_callback(lambda _: _semaforo.release())
+            raise
+    return time.perf_counter() - inicio
+
+def _pausa_reintento(error: Exception, intento: int, modelo: str) -> Optional[float]:
+    """Segundos a esperar antes de reintentar, o None si no se debe reintentar."""
+    if not isinstance(error, _ERRORES_REINTENTABLES) or intento >= LLM_MAX_REINTENTOS:
+        return None
+    concedido = _presupuesto.tomar()
+    _uso.registrar_reintento(modelo, concedido)
+    if not concedido:
+        return None
+    respuesta = getattr(error, "response", None)
+    retry_after = respuesta.headers.get("retry-after") if respuesta is not None else None
+    try:
+        return min(60.0, float(retry_after))
+    except (TypeError, ValueError):
+        return min(30.0, 0.5 * 2 ** intento) * (1 + random.random() * 0.25)
+
+
+class ChatOpenAICompartido(ChatOpenAI):
+    """
+    ChatOpenAI que respeta el límite de concurrencia del proceso, reintenta dentro del presupuesto
+    común y contabiliza el uso por modelo. El turno se libera durante las esperas entre reintentos.
+    """
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        intento = 0
+        while True:
+            with _turno_llm() as espera:
+                try:
+                    resultado = super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    _uso.registrar(self.model_name, espera, error=True)
+                    pausa = _pausa_reintento(e, intento, self.model_name)
+                    if pausa is None:
+                        raise
+                else:
+                    _uso.registrar(self.model_name, espera, resultado)
+                    return resultado
+            intento += 1
+            time.sleep(pausa)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        intento = 0
+        while True:
+            espera = await _esperar_turno_async()
+            try:
+                resultado = await super()._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            except Exception as e:
+                _uso.registrar(self.model_name, espera, error=True)
+                pausa = _pausa_reintento(e, intento, self.model_name)
+                if pausa is None:
+                    raise
+            else:
+                _uso.registrar(self.model_name, espera, resultado)
+                return resultado
+            finally:
+                _semaforo.release()
+            intento += 1
+            await asyncio.sleep(pausa)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        # En streaming los tokens no siempre llegan: solo se cuentan llamadas, errores y espera.
+        # Solo se reintenta si el error llega antes del primer trozo.
+        intento = 0
+        while True:
+            emitido = False
+            with _turno_llm() as espera:
+                try:
+                    for trozo in super()._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                        emitido = True
+                        yield trozo
+                except Exception as e:
+                    _uso.registrar(self.model_name, espera, error=True)
+                    pausa = None if emitido else _pausa_reintento(e, intento, self.model_name)
+                    if pausa is None:
+                        raise
+                else:
+                    _uso.registrar(self.model_name, espera)
+                    return
+            intento += 1
+            time.sleep(pausa)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        intento = 0
+        while True:
+            emitido = False
+            espera = await _esperar_turno_async()
+            try:
+                async for trozo in super()._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    emitido = True
+                    yield trozo
+            except Exception as e:
+                _uso.registrar(self.model_name, espera, error=True)
+                pausa = None if emitido else _pausa_reintento(e, intento, self.model_name)
+                if pausa is None:
+                    raise
+            else:
+                _uso.registrar(self.model_name, espera)
+                return
+            finally:
+                _semaforo.release()
+            intento += 1
+            await asyncio.sleep(pausa)
+
+
+_clientes_http: Dict[str, Any] = {}
+_llms: Dict[tuple, ChatOpenAICompartido] = {}
+_lock = threading.Lock()
+
+def _http_clientes() -> tuple:
+    """Clientes httpx del proceso, creados una sola vez (pool keep-alive compartido)."""
+    if not _clientes_http:
+        limites = httpx.Limits(max_connections=LLM_MAX_CONEXIONES,
+                               max_keepalive_connections=LLM_MAX_CONEXIONES)
+        _clientes_http["sync"] = httpx.Client(limits=limites, timeout=LLM_TIMEOUT_SEG)
+        _clientes_http["async"] = httpx.AsyncClient(limits=limites, timeout=LLM_TIMEOUT_SEG)
+    return _clientes_http["sync"], _clientes_http["async"]
+
+def obtener_llm(modelo: Optional[str] = None, temperature: float = 0,
+                rate_limiter=None) -> ChatOpenAICompartido:
+    """
+    Devuelve el LLM compartido para (modelo, temperature, rate_limiter), creándolo la primera vez.
+    Las callbacks de telemetría se pasan por llamada (pipeline.py), no aquí, para no contar dos veces.
+    """
+    modelo = modelo or OPENAI_MODEL
+    clave = (modelo, temperature, id(rate_limiter) if rate_limiter is not None else None)
+    with _lock:
+        if clave not in _llms:
+            cliente, cliente_async = _http_clientes()
+            _llms[clave] = ChatOpenAICompartido(
+                model=modelo,
+                temperature=temperature,
+                timeout=LLM_TIMEOUT_SEG,
+                max_retries=0,  # los reintentos los gestiona la clase, dentro del presupuesto común
+                rate_limiter=rate_limiter,
+                http_client=cliente,
+                http_async_client=cliente_async,
+            )
+        return _llms[clave]
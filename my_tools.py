@@ -2,16 +2,344 @@
 
 import requests
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import yfinance as yf
 from langchain_core.tools import StructuredTool, tool
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
+import contextvars
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from singleflight import SingleFlight
+from telemetry import span
+
+# --- Caché de históricos y control de tasa hacia las APIs externas ---
+
+# Tiempo de vida (segundos) de los históricos guardados en memoria.
+# prefetch.py refresca los activos de la watchlist antes de que caduquen.
+HISTORIAL_TTL_SEG = float(os.getenv("HISTORIAL_TTL_SEG", "900"))
+# Máximo de entradas en memoria (cada una puede ser un histórico period="max" completo);
+# al superarlo se expulsan las usadas hace más tiempo (LRU)
+HISTORIAL_MAX_ENTRADAS = int(os.getenv("HISTORIAL_MAX_ENTRADAS", "256"))
+
+_historial_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_historial_lock = threading.Lock()
+_cache_estadisticas = {"aciertos": 0, "fallos": 0}
+
+def _leer_cache_historial(clave: tuple):
+    """Devuelve el valor cacheado para 'clave' si existe y no ha caducado; si no, None."""
+    with _historial_lock:
+        entrada = _historial_cache.get(clave)
+        vigente = entrada is not None and time.monotonic() <= entrada[0]
+        _cache_estadisticas["aciertos" if vigente else "fallos"] += 1
+        if vigente:
+            _historial_cache.move_to_end(clave)
+    return entrada[1] if vigente else None
+
+def metricas_cache() -> Dict[str, int]:
+    """Devuelve los aciertos y fallos de la caché de históricos desde el arranque del proceso."""
+    with _historial_lock:
+        return dict(_cache_estadisticas, entradas=len(_historial_cache))
+
+def _guardar_cache_historial(clave: tuple, valor, ttl: float = None) -> None:
+    """
+    Guarda 'valor' en la caché de históricos durante 'ttl' segundos (por defecto HISTORIAL_TTL_SEG).
+    Aprovecha cada escritura para purgar lo caducado y, si aún se supera HISTORIAL_MAX_ENTRADAS,
+    expulsa las entradas menos usadas recientemente.
+    """
+    ttl = HISTORIAL_TTL_SEG if ttl is None else ttl
+    ahora = time.monotonic()
+    with _historial_lock:
+        for caducada in [c for c, (expira_en, _) in _historial_cache.items() if expira_en < ahora]:
+            del _historial_cache[caducada]
+        _historial_cache[clave] = (ahora + ttl, valor)
+        _historial_cache.move_to_end(clave)
+        while len(_historial_cache) > max(1, HISTORIAL_MAX_ENTRADAS):
+            _historial_cache.popitem(last=False)
+
+
+class LimitadorTasa:
+    """
+    Limitador de tasa thread-safe basado en un intervalo mínimo entre llamadas.
+    Lo comparten las herramientas interactivas y el prefetch, de modo que la suma
+    de ambos nunca supera el límite configurado para cada API.
+    """
+
+    def __init__(self, llamadas_por_minuto: float):
+        self.intervalo = 60.0 / llamadas_por_minuto if llamadas_por_minuto > 0 else 0.0
+        self._lock = threading.Lock()
+        self._proximo_turno = 0.0
+
+    def esperar(self) -> None:
+        """Bloquea hasta que haya un turno libre para llamar a la API."""
+        if self.intervalo <= 0:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._proximo_turno)
+            self._proximo_turno = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+_limitadores = {
+    "yahoo": LimitadorTasa(float(os.getenv("YAHOO_LLAMADAS_POR_MINUTO", "120"))),
+    "coingecko": LimitadorTasa(float(os.getenv("COINGECKO_LLAMADAS_POR_MINUTO", "25"))),
+}
+
+def configurar_limites(yahoo_por_minuto: Optional[float] = None,
+                       coingecko_por_minuto: Optional[float] = None) -> None:
+    """Sustituye en caliente los límites de llamadas por minuto hacia Yahoo Finance y/o CoinGecko."""
+    if yahoo_por_minuto is not None:
+        _limitadores["yahoo"] = LimitadorTasa(yahoo_por_minuto)
+    if coingecko_por_minuto is not None:
+        _limitadores["coingecko"] = LimitadorTasa(coingecko_por_minuto)
+
+# Una llamada en vuelo por clave: las peticiones concurrentes idénticas comparten resultado
+_vuelos = {
+    "yahoo": SingleFlight("yahoo"),
+    "coingecko": SingleFlight("coingecko"),
+}
+
+def metricas_coalescencia() -> Dict[str, Dict[str, int]]:
+    """Devuelve, por API, cuántas llamadas se recibieron, ejecutaron y coalescieron."""
+    return {nombre: vuelo.metricas() for nombre, vuelo in _vuelos.items()}
+
+def _historial_yahoo(ticker: str, refrescar: bool = False) -> pd.DataFrame:
+    """
+    Devuelve el histórico completo (period="max") de un ticker de Yahoo Finance,
+    sirviéndolo desde la caché en memoria cuando está fresco.
+    """
+    clave = ("yahoo", ticker.upper())
+    if not refrescar:
+        df = _leer_cache_historial(clave)
+        if df is not None:
+            return df
+
+    def _descargar():
+        _limitadores["yahoo"].esperar()
+        with span("http", "yahoo.history", ticker=ticker) as attrs:
+            df = yf.Ticker(ticker).history(period="max")
+            attrs["filas"] = len(df)
+        if not df.empty:
+            _guardar_cache_historial(clave, df)
+        return df
+
+    return _vuelos["yahoo"].ejecutar(clave, _descargar)
+
+def _info_yahoo(ticker: str) -> dict:
+    """Devuelve el diccionario 'info' de Yahoo Finance para un ticker, coalesciendo llamadas concurrentes."""
+    def _descargar():
+        _limitadores["yahoo"].esperar()
+        with span("http", "yahoo.info", ticker=ticker):
+            return yf.Ticker(ticker).info
+
+    return _vuelos["yahoo"].ejecutar(("yahoo_info", ticker.upper()), _descargar)
+
+def refrescar_historial_yahoo(ticker: str) -> int:
+    """Descarga de nuevo el histórico de 'ticker' y lo deja en caché. Devuelve el número de filas."""
+    return len(_historial_yahoo(ticker, refrescar=True))
+
 # --- Herramientas de CoinGecko ---
 
-BASE_URL_COINGECKO = "https://api.coingecko.com/api/v3"
+# Con COINGECKO_API_KEY se usa la API Pro (histórico completo); sin clave, la pública solo
+# sirve el último año de /market_chart/range
+COINGECKO_API_KEY = os.getenv("COINGECKO_API_KEY", "")
+BASE_URL_COINGECKO = ("https://pro-api.coingecko.com/api/v3" if COINGECKO_API_KEY
+                      else "https://api.coingecko.com/api/v3")
+COINGECKO_DIAS_HISTORIA_PUBLICA = 365
+
+# Sesión HTTP compartida: reutiliza conexiones keep-alive entre llamadas y bloques paralelos
+_sesion_http = requests.Session()
+_sesion_http.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=20))
+if COINGECKO_API_KEY:
+    _sesion_http.headers["x-cg-pro-api-key"] = COINGECKO_API_KEY
+
+# /market_chart/range devuelve datos horarios para rangos de hasta 90 días y diarios por encima.
+# Los últimos COINGECKO_DIAS_DETALLE días se piden en una sola llamada horaria (velas OHLC reales)
+# que comparten todas las consultas recientes; lo anterior se pide por bloques alineados de
+# COINGECKO_DIAS_POR_BLOQUE días, pero cada descarga empieza en la fecha pedida (no en el inicio
+# del bloque) y, sin clave, nunca antes del último año que sirve la API pública.
+# Coste en frío con el limitador (~2,4 s por llamada a 25/min): hasta ~88 días, 1 llamada; rangos
+# más largos, 1 + una por cada bloque tocado (normalmente 2-3).
+COINGECKO_DIAS_DETALLE = 90
+COINGECKO_DIAS_POR_BLOQUE = 720
+# Un bloque aún abierto solo aporta los días anteriores a la ventana reciente, que avanza un día por
+# día: puede cachearse mucho más que HISTORIAL_TTL_SEG sin dejar huecos (siempre que sea < 88 días).
+COINGECKO_TTL_BLOQUE_ABIERTO_SEG = 86400
+COINGECKO_DESCARGAS_PARALELAS = int(os.getenv("COINGECKO_DESCARGAS_PARALELAS", "4"))
+
+def _rango_coingecko(coin_id: str, desde_ts: int, hasta_ts: int) -> dict:
+    """
+    Descarga precios y volúmenes crudos de /coins/{coin_id}/market_chart/range entre dos
+    timestamps Unix (segundos). Lanza requests.HTTPError si CoinGecko no responde 200.
+    """
+    _limitadores["coingecko"].esperar()
+    url = f"{BASE_URL_COINGECKO}/coins/{coin_id}/market_chart/range"
+    params = {"vs_currency": "usd", "from": desde_ts, "to": hasta_ts}
+    with span("http", "coingecko.market_chart_range", coin_id=coin_id) as attrs:
+        response = _sesion_http.get(url, params=params, timeout=10)
+        attrs.update(status=response.status_code, bytes=len(response.content))
+    if response.status_code != 200:
+        raise requests.HTTPError(f"{response.status_code} - {response.text}", response=response)
+    return response.json()
+
+def _por_dia_coingecko(puntos: pd.DataFrame, columna: str) -> pd.Series:
+    """
+    Último valor de cada día UTC para puntos de granularidad diaria. CoinGecko los marca a las
+    00:00 UTC con el precio de cierre y el volumen de 24 h del día anterior, así que esos puntos
+    se asignan al día previo.
+    """
+    instantes = pd.to_datetime(puntos["ts"], unit="ms")
+    a_medianoche = (puntos["ts"] % 86_400_000) < 3_600_000
+    dias = instantes.dt.normalize() - pd.to_timedelta(a_medianoche.astype(int), unit="D")
+    return pd.Series(puntos[columna].to_numpy(), index=pd.DatetimeIndex(dias)).groupby(level=0).last()
+
+def _remuestrear_diario(data: dict) -> pd.DataFrame:
+    """
+    Convierte la respuesta cruda de market_chart en velas diarias (UTC) Open/High/Low/Close/Volume.
+    El volumen de CoinGecko es acumulado de 24h en cada punto, así que se toma el último del día.
+    Si la respuesta solo trae un punto por día (rangos de más de 90 días) no hay vela real:
+    Open, High y Low quedan a NaN y solo se informan Close y Volume.
+    """
+    precios = pd.DataFrame(data.get("prices") or [], columns=["ts", "precio"])
+    volumenes = pd.DataFrame(data.get("total_volumes") or [], columns=["ts", "volumen"])
+    if precios.empty:
+        return pd.DataFrame(columns=["Open", "High", "Low", "Close", "Volume"], index=pd.DatetimeIndex([]))
+
+    # Granularidad diaria: puntos separados más de 2 h entre sí (la horaria los separa 1 h)
+    if len(precios) > 1 and np.median(np.diff(precios["ts"].to_numpy())) > 2 * 3_600_000:
+        diario = pd.DataFrame({"Close": _por_dia_coingecko(precios, "precio")})
+        diario.insert(0, "Open", np.nan)
+        diario.insert(1, "High", np.nan)
+        diario.insert(2, "Low", np.nan)
+        diario["Volume"] = _por_dia_coingecko(volumenes, "volumen") if not volumenes.empty else np.nan
+        return diario.dropna(subset=["Close"])
+
+    serie_precio = pd.Series(precios["precio"].to_numpy(), index=pd.to_datetime(precios["ts"], unit="ms"))
+    serie_volumen = pd.Series(volumenes["volumen"].to_numpy(), index=pd.to_datetime(volumenes["ts"], unit="ms"))
+
+    diario = serie_precio.resample("1D").ohlc()
+    diario.columns = ["Open", "High", "Low", "Close"]
+    diario["Volume"] = serie_volumen.resample("1D").last()
+    return diario.dropna(subset=["Close"])
+
+def _inicio_detalle_coingecko() -> datetime:
+    """Primer día UTC completo cubierto por la ventana horaria reciente."""
+    desde = datetime.utcnow() - timedelta(days=COINGECKO_DIAS_DETALLE) + timedelta(hours=1)
+    return datetime(desde.year, desde.month, desde.day) + timedelta(days=1)
+
+def _ventana_reciente_coingecko(coin_id: str, refrescar: bool = False) -> pd.DataFrame:
+    """
+    Velas diarias de los últimos ~COINGECKO_DIAS_DETALLE días a partir de datos horarios, con una
+    sola llamada. Caduca con HISTORIAL_TTL_SEG (incluye el día en curso).
+    """
+    clave = ("coingecko_reciente", coin_id.lower())
+    if not refrescar:
+        df = _leer_cache_historial(clave)
+        if df is not None:
+            return df
+
+    def _descargar():
+        ahora_ts = int(time.time())
+        # Una hora menos que el límite para que CoinGecko siga devolviendo granularidad horaria
+        desde_ts = ahora_ts - COINGECKO_DIAS_DETALLE * 86400 + 3600
+        df = _remuestrear_diario(_rango_coingecko(coin_id, desde_ts, ahora_ts))
+        # El primer día solo está cubierto en parte: sus velas serían incorrectas
+        df = df.loc[_inicio_detalle_coingecko():]
+        _guardar_cache_historial(clave, df)
+        return df
+
+    return _vuelos["coingecko"].ejecutar(clave, _descargar)
+
+def _bloque_historico_coingecko(coin_id: str, bloque: int, inicio: datetime) -> pd.DataFrame:
+    """
+    Velas diarias del bloque número 'bloque' (bloques de COINGECKO_DIAS_POR_BLOQUE días contados
+    desde 1970-01-01 UTC) desde el día 'inicio'. Solo se descarga desde 'inicio' (y, sin clave, desde
+    hace COINGECKO_DIAS_HISTORIA_PUBLICA días como mucho); la caché recuerda desde dónde cubre y solo
+    vuelve a descargar si se pide una fecha anterior. Los bloques cerrados se cachean sin caducidad;
+    el abierto usa COINGECKO_TTL_BLOQUE_ABIERTO_SEG.
+    """
+    ahora_ts = int(time.time())
+    inicio_bloque_ts = bloque * COINGECKO_DIAS_POR_BLOQUE * 86400
+    fin_bloque_ts = inicio_bloque_ts + COINGECKO_DIAS_POR_BLOQUE * 86400
+    inicio_dia = datetime(inicio.year, inicio.month, inicio.day)
+    desde_ts = max(inicio_bloque_ts, int((inicio_dia - datetime(1970, 1, 1)).total_seconds()))
+    if not COINGECKO_API_KEY:
+        # Una hora de margen para no pedir nada fuera de la ventana de la API pública
+        desde_ts = max(desde_ts, ahora_ts - COINGECKO_DIAS_HISTORIA_PUBLICA * 86400 + 3600)
+    if desde_ts >= min(fin_bloque_ts, ahora_ts):
+        return _remuestrear_diario({})
+
+    clave = ("coingecko_bloque", coin_id.lower(), bloque)
+    cacheado = _leer_cache_historial(clave)
+    if cacheado is not None and cacheado[0] <= desde_ts:
+        return cacheado[1]
+
+    def _descargar():
+        df = _remuestrear_diario(_rango_coingecko(coin_id, desde_ts, min(fin_bloque_ts - 1, ahora_ts)))
+        cerrado = fin_bloque_ts <= ahora_ts
+        _guardar_cache_historial(clave, (desde_ts, df),
+                                 ttl=float("inf") if cerrado else COINGECKO_TTL_BLOQUE_ABIERTO_SEG)
+        return df
+
+    return _vuelos["coingecko"].ejecutar((*clave, desde_ts), _descargar)
+
+def _historial_diario_coingecko(coin_id: str, inicio: datetime, fin: datetime,
+                                refrescar: bool = False) -> pd.DataFrame:
+    """
+    Devuelve velas diarias OHLCV de CoinGecko entre 'inicio' y 'fin' (fechas UTC, ambos incluidos).
+    Combina la ventana horaria reciente y los bloques históricos diarios que hagan falta; los que
+    no estén en caché se piden a la vez (el limitador de CoinGecko sigue marcando el ritmo).
+    """
+    inicio_detalle = _inicio_detalle_coingecko()
+    tareas = []
+    if inicio < inicio_detalle:
+        epoca = datetime(1970, 1, 1)
+        hasta_historico = min(fin, inicio_detalle - timedelta(days=1))
+        primer_bloque = (inicio - epoca).days // COINGECKO_DIAS_POR_BLOQUE
+        ultimo_bloque = (hasta_historico - epoca).days // COINGECKO_DIAS_POR_BLOQUE
+        tareas += [functools.partial(_bloque_historico_coingecko, coin_id, b, inicio)
+                   for b in range(primer_bloque, ultimo_bloque + 1)]
+    if fin >= inicio_detalle:
+        # Al refrescar solo se vuelve a pedir la ventana reciente; lo anterior no cambia
+        tareas.append(functools.partial(_ventana_reciente_coingecko, coin_id, refrescar))
+
+    if len(tareas) == 1:
+        partes = [tareas[0]()]
+    else:
+        with ThreadPoolExecutor(max_workers=min(COINGECKO_DESCARGAS_PARALELAS, len(tareas))) as executor:
+            # Cada descarga corre en una copia del contexto para que sus spans cuelguen del turno actual
+            futuros = [executor.submit(contextvars.copy_context().run, t) for t in tareas]
+            partes = [f.result() for f in futuros]
+
+    # La ventana reciente va la última: donde se solapa con un bloque diario, ganan sus velas horarias
+    df = pd.concat(partes)
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df.loc[inicio.strftime('%Y-%m-%d'):fin.strftime('%Y-%m-%d')]
+
+def refrescar_historial_coingecko(coin_id: str, dias: int) -> int:
+    """Refresca las velas diarias de los últimos 'dias' días de 'coin_id' en caché. Devuelve el número de filas."""
+    fin = datetime.utcnow()
+    return len(_historial_diario_coingecko(coin_id, fin - timedelta(days=dias - 1), fin, refrescar=True))
+
+def _info_coingecko(coin_id: str) -> requests.Response:
+    """Consulta /coins/{coin_id} en CoinGecko, coalesciendo llamadas concurrentes al mismo ID."""
+    def _descargar():
+        _limitadores["coingecko"].esperar()
+        with span("http", "coingecko.coin_info", coin_id=coin_id) as attrs:
+            response = _sesion_http.get(f"{BASE_URL_COINGECKO}/coins/{coin_id}", timeout=10) # Añadir timeout para evitar esperas infinitas
+            attrs.update(status=response.status_code, bytes=len(response.content))
+        return response
+
+    return _vuelos["coingecko"].ejecutar(("coingecko_info", coin_id.lower()), _descargar)
 
 def obtener_info_cripto(coin_id: str) -> str:
     """
@@ -25,10 +353,8 @@ def obtener_info_cripto(coin_id: str) -> str:
         str: JSON string con nombre, descripción, fecha de lanzamiento y última actualización,
              o un mensaje de error.
     """
-    url = f"{BASE_URL_COINGECKO}/coins/{coin_id}"
-
     try:
-        response = requests.get(url, timeout=10) # Añadir timeout para evitar esperas infinitas
+        response = _info_coingecko(coin_id)
         if response.status_code != 200:
             return json.dumps({
                 "error": f"Error al obtener datos de {coin_id} desde CoinGecko. Código: {response.status_code}. Mensaje: {response.text}"
@@ -72,46 +398,49 @@ obtener_info_cripto_tool = StructuredTool.from_function(
 )
 
 
-def obtener_historico_precios_coingecko(coin_id: str, dias: int) -> str:
-    """
-    Obtiene histórico OHLC diario de una criptomoneda desde CoinGecko.
-    Solo permite valores válidos de días (1, 7, 14, 30, 90, 180, 365).
-    Devuelve un JSON string con lista de datos diarios (Date, Open, High, Low, Close, Volume=None).
+def obtener_historico_precios_coingecko(coin_id: str, dias: int = 30,
+                                        fecha_inicio: Optional[str] = None,
+                                        fecha_fin: Optional[str] = None) -> str:
     """
-    # CoinGecko solo permite estos valores en el endpoint /ohlc
-    valores_validos_ohlc = [1, 7, 14, 30, 90, 180, 365]
-    dias_param = dias if dias in valores_validos_ohlc else 30  # Fallback seguro
+    Obtiene histórico OHLCV diario de una criptomoneda desde CoinGecko para cualquier rango de fechas.
+    Los últimos ~88 días tienen velas OHLC reales (de datos horarios); en días anteriores CoinGecko
+    solo da un precio diario, así que Open, High y Low se devuelven como null.
 
-    url = f"{BASE_URL_COINGECKO}/coins/{coin_id}/ohlc"
-    params = {
-        "vs_currency": "usd",
-        "days": dias_param
-    }
+    Args:
+        coin_id (str): ID de la criptomoneda en CoinGecko (ej. 'bitcoin').
+        dias (int): Número de días recientes a obtener (se ignora si se indica fecha_inicio).
+        fecha_inicio (str, opcional): Fecha inicial 'YYYY-MM-DD' (UTC).
+        fecha_fin (str, opcional): Fecha final 'YYYY-MM-DD' (UTC); por defecto hoy.
 
+    Returns:
+        str: JSON string con lista de datos diarios (Date, Open, High, Low, Close, Volume) o un error.
+    """
     try:
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code != 200:
-            return json.dumps([{"error": f"Error al obtener histórico de {coin_id}: {response.status_code} - {response.text}"}], ensure_ascii=False, indent=2)
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d') if fecha_fin else datetime.utcnow()
+        if fecha_inicio:
+            inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+        else:
+            if dias < 1:
+                return json.dumps([{"error": "El número de días debe ser al menos 1."}], ensure_ascii=False, indent=2)
+            inicio = fin - timedelta(days=dias - 1)
+        if inicio > fin:
+            return json.dumps([{"error": f"La fecha inicial {inicio:%Y-%m-%d} es posterior a la final {fin:%Y-%m-%d}."}], ensure_ascii=False, indent=2)
 
-        data = response.json()
-        if not data:
-             return json.dumps([{"error": f"No se encontraron datos históricos para {coin_id} para los últimos {dias_param} días."}], ensure_ascii=False, indent=2)
-
-        resultados = []
-        for item in data:
-            timestamp_ms, open_p, high_p, low_p, close_p = item
-            date_str = datetime.utcfromtimestamp(timestamp_ms / 1000).strftime('%Y-%m-%d')
-            resultados.append({
-                "Date": date_str,
-                "Open": open_p,
-                "High": high_p,
-                "Low": low_p,
-                "Close": close_p,
-                "Volume": None  # No disponible en este endpoint de CoinGecko
-            })
-
-        return json.dumps(resultados, ensure_ascii=False, indent=2)
+        df = _historial_diario_coingecko(coin_id, inicio, fin)
+        if df.empty:
+             return json.dumps([{"error": f"No se encontraron datos históricos para {coin_id} entre {inicio:%Y-%m-%d} y {fin:%Y-%m-%d}."}], ensure_ascii=False, indent=2)
+
+        df = df.reset_index(names="Date")
+        df["Date"] = df["Date"].dt.strftime('%Y-%m-%d')
+        # NaN no es JSON válido: los volúmenes ausentes se devuelven como null
+        df = df.astype(object).where(df.notna(), None)
+
+        return json.dumps(df.to_dict(orient="records"), ensure_ascii=False, indent=2)
 
+    except ValueError as e:
+        return json.dumps([{"error": f"Fecha inválida (usa el formato YYYY-MM-DD): {str(e)}"}], ensure_ascii=False, indent=2)
+    except requests.exceptions.HTTPError as e:
+        return json.dumps([{"error": f"Error al obtener histórico de {coin_id}: {str(e)}"}], ensure_ascii=False, indent=2)
     except requests.exceptions.Timeout:
         return json.dumps([{"error": f"Tiempo de espera agotado al consultar histórico de {coin_id} en CoinGecko."}], ensure_ascii=False, indent=2)
     except requests.exceptions.RequestException as e:
@@ -123,7 +452,7 @@ def obtener_historico_precios_coingecko(coin_id: str, dias: int) -> str:
 obtener_historico_precios_coingecko_tool = StructuredTool.from_function(
     func=obtener_historico_precios_coingecko,
     name="obtener_historico_precios_coingecko",
-    description="Obtiene histórico OHLC diario de una criptomoneda desde CoinGecko para los últimos N días válidos (1,7,14,30,90,180,365), devuelve JSON string."
+    description="Obtiene histórico OHLCV diario de una criptomoneda desde CoinGecko para los últimos N días o para un rango de fechas (fecha_inicio/fecha_fin en formato YYYY-MM-DD), devuelve JSON string. Los últimos ~88 días tienen velas OHLC reales; antes solo hay un cierre por día (Open, High y Low a null). Hasta ~88 días cuesta 1 llamada a CoinGecko; rangos más largos, normalmente 2-3."
 )
 
 # --- Herramientas de Yahoo Finance ---
@@ -140,8 +469,7 @@ def obtener_info_yahoo(ticker: str) -> str:
              o un mensaje de error.
     """
     try:
-        cripto = yf.Ticker(ticker)
-        info = cripto.info
+        info = _info_yahoo(ticker)
 
         if not isinstance(info, dict) or not info:
             return json.dumps({"error": f"No se pudo obtener información para el ticker: {ticker}. Podría ser inválido o no encontrado."}, ensure_ascii=False, indent=2)
@@ -152,7 +480,7 @@ def obtener_info_yahoo(ticker: str) -> str:
         if len(descripcion) > 500: # Limitar la longitud de la descripción
             descripcion = descripcion[:500] + "..."
 
-        historico = cripto.history(period="max")
+        historico = _historial_yahoo(ticker)
 
         if not historico.empty:
             fecha_primera_cotizacion = historico.index[0].strftime('%Y-%m-%d')
@@ -188,8 +516,7 @@ def obtener_historico_precios(ticker: str, dias: int) -> str:
     Devuelve un JSON string con lista de diccionarios con columnas: Date, Open, High, Low, Close, Volume.
     """
     try:
-        cripto = yf.Ticker(ticker)
-        df = cripto.history(period="max")
+        df = _historial_yahoo(ticker)
         
         if df.empty:
             return json.dumps({"error": f"No se encontraron datos históricos para el ticker: {ticker}."}, ensure_ascii=False, indent=2)
@@ -213,6 +540,14 @@ obtener_historico_precios_tool = StructuredTool.from_function(
     description="Obtiene histórico OHLCV de un activo dada su ticker en Yahoo Finance para los últimos N días, devuelve JSON string."
 )
 
+def _nombre_grafico(base: str) -> str:
+    """
+    Nombre de archivo único por render: las herramientas se ejecutan en paralelo (batch.py, api.py)
+    y un nombre fijo haría que una ejecución sobrescribiera el gráfico de otra.
+    """
+    base = "".join(c if c.isalnum() or c in "-_" else "_" for c in base)
+    return f"{base}_{uuid.uuid4().hex[:8]}.png"
+
 @tool
 def obtener_y_graficar(ticker: str, dias: int = 30, columna: str = "Close") -> str:
     """
@@ -227,8 +562,7 @@ def obtener_y_graficar(ticker: str, dias: int = 30, columna: str = "Close") -> s
         str: Ruta del archivo PNG generado o mensaje de error.
     """
     try:
-        cripto = yf.Ticker(ticker)
-        df = cripto.history(period="max")
+        df = _historial_yahoo(ticker)
         
         if df.empty:
             return "Error: no se encontraron datos históricos para graficar el ticker. Podría ser inválido o no haber datos disponibles."
@@ -243,38 +577,142 @@ def obtener_y_graficar(ticker: str, dias: int = 30, columna: str = "Close") -> s
 
         df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
 
-        plt.figure(figsize=(12, 7)) # Tamaño de figura más grande
-        plt.plot(df['Date'], df[columna], label=columna, color='skyblue')
+        # API orientada a objetos: cada llamada tiene su propia figura, sin estado global de pyplot entre hilos
+        fig = Figure(figsize=(12, 7)) # Tamaño de figura más grande
+        ax = fig.subplots()
+        ax.plot(df['Date'], df[columna], label=columna, color='skyblue')
         
         # Añadir más ticks en el eje X para mejorar la legibilidad en gráficos largos
         n_ticks = min(len(df['Date']), 10) # Máximo 10 ticks o menos si hay menos datos
-        plt.xticks(df['Date'].iloc[::max(1, len(df['Date']) // n_ticks)], rotation=45, ha='right')
+        posiciones = df['Date'].iloc[::max(1, len(df['Date']) // n_ticks)]
+        ax.set_xticks(posiciones)
+        ax.set_xticklabels(posiciones, rotation=45, ha='right')
         
-        plt.xlabel("Fecha", fontsize=12)
-        plt.ylabel(f"{columna} (USD)", fontsize=12)
-        plt.title(f"Serie temporal de {columna} para {ticker} (Últimos {dias} días)", fontsize=14)
-        plt.legend(fontsize=10)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.tight_layout()
+        ax.set_xlabel("Fecha", fontsize=12)
+        ax.set_ylabel(f"{columna} (USD)", fontsize=12)
+        ax.set_title(f"Serie temporal de {columna} para {ticker} (Últimos {dias} días)", fontsize=14)
+        ax.legend(fontsize=10)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        fig.tight_layout()
 
-        nombre_archivo = f"grafico_{ticker}_{columna}.png" # Nombre de archivo más específico
-        plt.savefig(nombre_archivo, dpi=300) # Mejorar la resolución
-        plt.close()
+        nombre_archivo = _nombre_grafico(f"grafico_{ticker}_{columna}") # Nombre de archivo más específico
+        with span("render", "matplotlib.savefig", dpi=300):
+            fig.savefig(nombre_archivo, dpi=300) # Mejorar la resolución
 
         return nombre_archivo
 
     except Exception as e:
         return f"Error al generar la gráfica para {ticker}: {str(e)}"
 
+MODOS_COMPARACION = ("precio", "base100", "retornos")
+
+def _serie_comparable(df: pd.DataFrame, columna: str) -> pd.Series:
+    """Columna del histórico indexada por fecha sin zona horaria, para alinear bolsas y criptos."""
+    indice = df.index.tz_localize(None) if getattr(df.index, "tz", None) is not None else df.index
+    serie = pd.Series(df[columna].to_numpy(), index=pd.DatetimeIndex(indice).normalize())
+    return serie[~serie.index.duplicated(keep="last")]
+
+@tool
+def graficar_comparacion(tickers: List[str], dias: int = 90, columna: str = "Close",
+                         modo: str = "base100") -> str:
+    """
+    Compara varios activos de Yahoo Finance en una sola gráfica.
+
+    Args:
+        tickers (List[str]): Tickers a comparar (ej. ['BTC-USD', 'ETH-USD', 'AAPL']).
+        dias (int): Número de días naturales recientes a graficar.
+        columna (str): Columna a comparar ('Open', 'High', 'Low', 'Close', 'Volume').
+        modo (str): 'precio' (valores tal cual), 'base100' (todas las series empiezan en 100)
+                    o 'retornos' (retorno porcentual diario).
+
+    Returns:
+        str: Ruta del archivo PNG generado (si faltan datos de algún ticker, seguida de una línea
+             que indica cuáles se omitieron) o mensaje de error.
+    """
+    if modo not in MODOS_COMPARACION:
+        return f"Error: modo '{modo}' no soportado. Usa uno de: {', '.join(MODOS_COMPARACION)}"
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers if t and t.strip()))
+    if len(tickers) < 2:
+        return "Error: indica al menos dos tickers para comparar."
+
+    try:
+        # Una sola pasada de descarga: los históricos se piden en paralelo (y salen de caché si están frescos)
+        with ThreadPoolExecutor(max_workers=min(len(tickers), 8)) as executor:
+            futuros = {t: executor.submit(contextvars.copy_context().run, _historial_yahoo, t) for t in tickers}
+        series, fallidos = {}, []
+        for t, futuro in futuros.items():
+            try:
+                df = futuro.result()
+            except Exception:
+                df = pd.DataFrame()
+            if df.empty or columna not in df.columns:
+                fallidos.append(t)
+            else:
+                series[t] = _serie_comparable(df, columna)
+        if len(series) < 2:
+            return f"Error: no se encontraron datos de '{columna}' suficientes para comparar. Sin datos: {', '.join(fallidos)}"
+
+        # Alineación vectorizada sobre un índice de fechas común; los días sin cotización
+        # (fines de semana de las acciones frente a las criptos) arrastran el último valor
+        datos = pd.concat(series, axis=1, join="outer").sort_index()
+        datos = datos.loc[datos.index >= datos.index.max() - pd.Timedelta(days=dias)].ffill().dropna()
+        if len(datos) < 2:
+            return "Error: las series no tienen fechas en común suficientes en el rango pedido."
+
+        if modo == "base100":
+            datos = datos / datos.iloc[0] * 100
+            etiqueta_y = f"{columna} (base 100)"
+        elif modo == "retornos":
+            datos = datos.pct_change().iloc[1:] * 100
+            etiqueta_y = f"Retorno diario de {columna} (%)"
+        else:
+            etiqueta_y = f"{columna} (USD)"
+
+        # API orientada a objetos: una figura independiente, sin estado global de pyplot entre hilos
+        fig = Figure(figsize=(12, 7))
+        ax = fig.subplots()
+        for t in datos.columns:
+            ax.plot(datos.index, datos[t], label=t, linewidth=1.2)
+        ax.set_xlabel("Fecha", fontsize=12)
+        ax.set_ylabel(etiqueta_y, fontsize=12)
+        ax.set_title(f"Comparación de {columna} ({modo}) - últimos {dias} días", fontsize=14)
+        ax.legend(fontsize=10)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        fig.autofmt_xdate(rotation=45)
+        fig.tight_layout()
+
+        nombre_archivo = _nombre_grafico(f"grafico_comparacion_{'_'.join(datos.columns)}_{columna}_{modo}")
+        with span("render", "matplotlib.savefig", dpi=150, series=len(datos.columns)):
+            fig.savefig(nombre_archivo, dpi=150)
+
+        if fallidos:
+            # La primera línea sigue siendo la ruta, para que la interfaz muestre la imagen
+            return (f"{nombre_archivo}\nAviso: sin datos de '{columna}' para {', '.join(fallidos)}; "
+                    f"el gráfico solo compara {', '.join(datos.columns)}.")
+        return nombre_archivo
+
+    except Exception as e:
+        return f"Error al generar la gráfica comparativa: {str(e)}"
+
 # --- Herramientas de Cálculo y Exportación ---
 
 @tool
-def calcular_retorno_low_series(precios_low: List[float]) -> str:
+def calcular_retorno_low_series(precios_low: Optional[List[float]] = None,
+                                ticker: Optional[str] = None, dias: int = 30) -> str:
     """
     Calcula los retornos porcentuales diarios para una serie de precios bajos.
+    Si se indica 'ticker' en lugar de precios, lee los retornos ya precalculados en la base
+    de datos para sus últimas 'dias' sesiones (el activo debe estar guardado).
     Devuelve una cadena de texto legible con los retornos.
     """
     try:
+        if not precios_low and ticker:
+            df = _leer_indicadores(ticker, ["ret_low"], dias)
+            if df.empty:
+                return f"No hay retornos precalculados para {ticker}. Guarda antes su histórico en la base de datos o pasa los precios."
+            retornos = [0.0 if pd.isna(r) else r * 100 for r in df["ret_low"]]
+            return _formatear_retornos(retornos)
+
         if not precios_low or len(precios_low) < 2:
             return "No hay suficientes datos para calcular retornos (se necesitan al menos 2 precios)."
 
@@ -293,18 +731,21 @@ def calcular_retorno_low_series(precios_low: List[float]) -> str:
                 retorno = (actual - anterior) / anterior * 100
                 retornos.append(retorno)
 
-        # Formatea los retornos para que el LLM los pueda leer
-        # Limitar la cantidad de retornos mostrados para no sobrecargar el LLM
-        if len(retornos) > 20:
-            formatted_retornos = [f"{r:.2f}%" for r in retornos[:10]] + ["..."] + [f"{r:.2f}%" for r in retornos[-10:]]
-            return f"Retornos porcentuales diarios (primeros 10 y últimos 10): {', '.join(formatted_retornos)}"
-        else:
-            formatted_retornos = [f"{r:.2f}%" for r in retornos]
-            return f"Retornos porcentuales diarios: {', '.join(formatted_retornos)}"
+        return _formatear_retornos(retornos)
 
     except Exception as e:
         return f"Error al calcular retornos: {str(e)}"
 
+def _formatear_retornos(retornos: List[float]) -> str:
+    """Formatea los retornos (en %) para que el LLM los pueda leer."""
+    # Limitar la cantidad de retornos mostrados para no sobrecargar el LLM
+    if len(retornos) > 20:
+        formatted_retornos = [f"{r:.2f}%" for r in retornos[:10]] + ["..."] + [f"{r:.2f}%" for r in retornos[-10:]]
+        return f"Retornos porcentuales diarios (primeros 10 y últimos 10): {', '.join(formatted_retornos)}"
+    else:
+        formatted_retornos = [f"{r:.2f}%" for r in retornos]
+        return f"Retornos porcentuales diarios: {', '.join(formatted_retornos)}"
+
 
 @tool
 def guardar_datos_json(datos: List[Dict], nombre_archivo: str = "datos_precios.json") -> str:
@@ -334,20 +775,221 @@ def guardar_datos_json(datos: List[Dict], nombre_archivo: str = "datos_precios.j
     except Exception as e:
         return f"Error al guardar datos en el archivo {nombre_archivo}: {str(e)}"
 
+# --- Exportación columnar (Parquet / Arrow IPC) ---
+
+# Lotes de filas que se escriben como un row group cada uno: la exportación nunca
+# materializa todas las series a la vez en memoria.
+FILAS_POR_LOTE_EXPORT = 50_000
+
+def _importar_pyarrow():
+    """Importa pyarrow bajo demanda; es una dependencia opcional solo necesaria para exportar."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.dataset as ds
+        import pyarrow.fs as pafs
+    except ImportError as e:
+        raise ImportError("La exportación columnar requiere pyarrow (pip install pyarrow).") from e
+    return pa, pq, ds, pafs
+
+def _esquema_export(pa, con_ticker: bool):
+    """Esquema de las exportaciones; con partición por ticker la columna la aporta el directorio."""
+    campos = [("ticker", pa.string())] if con_ticker else []
+    campos += [
+        ("date", pa.date32()),
+        ("open", pa.float64()),
+        ("high", pa.float64()),
+        ("low", pa.float64()),
+        ("close", pa.float64()),
+        ("volume", pa.float64()),
+    ]
+    return pa.schema(campos)
+
+def _lotes_df(ticker: str, df: pd.DataFrame):
+    """Normaliza un histórico OHLCV indexado por fecha y lo trocea en DataFrames de FILAS_POR_LOTE_EXPORT."""
+    df = df[["Open", "High", "Low", "Close", "Volume"]].astype("float64")
+    df.columns = ["open", "high", "low", "close", "volume"]
+    fechas = pd.DatetimeIndex(df.index)
+    if fechas.tz is not None:
+        fechas = fechas.tz_localize(None)
+    df.insert(0, "date", fechas.normalize().date)
+    df.insert(0, "ticker", ticker)
+    df = df.reset_index(drop=True)
+    for inicio in range(0, len(df), FILAS_POR_LOTE_EXPORT):
+        yield df.iloc[inicio:inicio + FILAS_POR_LOTE_EXPORT]
+
+def _lotes_historico(tickers: List[str], fuente: str, dias: int):
+    """
+    Genera (ticker, DataFrame) por lotes, ticker a ticker, desde la caché/API de Yahoo,
+    CoinGecko o directamente desde 'historical_prices' con un cursor de servidor.
+    En las tres fuentes 'dias' son días naturales: desde hoy - (dias - 1) hasta hoy (UTC).
+    """
+    fin = datetime.utcnow()
+    desde = (fin - timedelta(days=dias - 1)).date()
+    for ticker in tickers:
+        if fuente == "yahoo":
+            df = _historial_yahoo(ticker)
+            fechas = pd.DatetimeIndex(df.index)
+            if fechas.tz is not None:
+                fechas = fechas.tz_localize(None)
+            df = df[fechas.normalize() >= pd.Timestamp(desde)]
+            yield from ((ticker, lote) for lote in _lotes_df(ticker, df))
+        elif fuente == "coingecko":
+            df = _historial_diario_coingecko(ticker, datetime(desde.year, desde.month, desde.day), fin)
+            yield from ((ticker, lote) for lote in _lotes_df(ticker, df))
+        else:
+            conn = _get_db_connection()
+            try:
+                # Cursor con nombre = cursor de servidor: las filas llegan por lotes, no todas de golpe
+                with conn.cursor(name=f"export_{abs(hash(ticker))}") as cur:
+                    cur.itersize = FILAS_POR_LOTE_EXPORT
+                    with span("sql", "SELECT historical_prices (export)", ticker=ticker):
+                        cur.execute("""
+                            SELECT ticker, date, open, high, low, close, volume
+                            FROM historical_prices
+                            WHERE ticker = %s AND date >= %s
+                            ORDER BY date
+                        """, (ticker, desde))
+                    while True:
+                        filas = cur.fetchmany(FILAS_POR_LOTE_EXPORT)
+                        if not filas:
+                            break
+                        lote = pd.DataFrame(filas, columns=["ticker", "date", "open", "high", "low", "close", "volume"])
+                        lote[["open", "high", "low", "close", "volume"]] = lote[["open", "high", "low", "close", "volume"]].astype("float64")
+                        yield ticker, lote
+                conn.commit()
+            except BaseException:
+                # También si el consumidor deja de iterar (GeneratorExit): no devolver al pool
+                # una conexión con la transacción abierta
+                conn.rollback()
+                raise
+            finally:
+                _return_db_connection(conn)
+
+@tool
+def exportar_historico_columnar(tickers: List[str], fuente: str = "yahoo", dias: int = 365,
+                                formato: str = "parquet", particionar_por_ticker: bool = False,
+                                ruta_salida: str = "export_historico") -> str:
+    """
+    Exporta el histórico OHLCV de uno o varios activos a Parquet comprimido (o Arrow IPC/Feather)
+    sin pasar los datos por el LLM: se leen directamente de la fuente y se escriben por lotes.
+
+    Args:
+        tickers (List[str]): Tickers de Yahoo, IDs de CoinGecko o tickers guardados en la base de datos.
+        fuente (str): 'yahoo', 'coingecko' o 'db' (tabla historical_prices).
+        dias (int): Número de días naturales recientes a exportar (hoy incluido), igual en todas las fuentes.
+        formato (str): 'parquet' (zstd) o 'feather' (Arrow IPC sin comprimir, apto para memory-map).
+        particionar_por_ticker (bool): Si es True, escribe un directorio ticker=<TICKER>/ por activo.
+        ruta_salida (str): Ruta del archivo (o directorio si se particiona, que debe estar vacío o no existir), sin extensión.
+
+    Returns:
+        str: Resumen con la ruta generada y el número de filas, o mensaje de error.
+    """
+    try:
+        if fuente not in ("yahoo", "coingecko", "db"):
+            return "Error: la fuente debe ser 'yahoo', 'coingecko' o 'db'."
+        if formato not in ("parquet", "feather"):
+            return "Error: el formato debe ser 'parquet' o 'feather'."
+        # Sin repetidos (conservando el orden): un ticker repetido duplicaría filas o,
+        # al particionar, reabriría y sobrescribiría su partición
+        normalizar = {"yahoo": str.upper, "coingecko": str.lower}.get(fuente, str)
+        tickers = list(dict.fromkeys(normalizar(t.strip()) for t in tickers or [] if t and t.strip()))
+        if not tickers:
+            return "Error: indica al menos un ticker para exportar."
+        if particionar_por_ticker and os.path.isdir(ruta_salida) and os.listdir(ruta_salida):
+            # Las particiones antiguas se leerían después como parte del dataset
+            return f"Error: el directorio '{ruta_salida}' ya existe y no está vacío. Indica otra ruta_salida o vacíalo antes de exportar."
+
+        pa, pq, _, _ = _importar_pyarrow()
+        extension = ".parquet" if formato == "parquet" else ".feather"
+        esquema = _esquema_export(pa, con_ticker=not particionar_por_ticker)
+
+        def _abrir(ruta: str):
+            if formato == "parquet":
+                return pq.ParquetWriter(ruta, esquema, compression="zstd")
+            return pa.ipc.new_file(ruta, esquema)
+
+        def _escribir(writer, lote: pd.DataFrame):
+            if particionar_por_ticker:
+                lote = lote.drop(columns=["ticker"])
+            # En Parquet cada lote queda como un row group; en IPC como un record batch
+            writer.write_table(pa.Table.from_pandas(lote, schema=esquema, preserve_index=False))
+
+        filas_totales, filas_por_ticker = 0, {}
+        writer, ticker_actual = None, None
+        try:
+            if not particionar_por_ticker:
+                ruta_final = ruta_salida + extension
+                writer = _abrir(ruta_final)
+            else:
+                ruta_final = ruta_salida
+            for ticker, lote in _lotes_historico(tickers, fuente, dias):
+                if particionar_por_ticker and ticker != ticker_actual:
+                    if writer is not None:
+                        writer.close()
+                    directorio = os.path.join(ruta_salida, f"ticker={ticker}")
+                    os.makedirs(directorio, exist_ok=True)
+                    writer = _abrir(os.path.join(directorio, f"part-0{extension}"))
+                    ticker_actual = ticker
+                _escribir(writer, lote)
+                filas_totales += len(lote)
+                filas_por_ticker[ticker] = filas_por_ticker.get(ticker, 0) + len(lote)
+        finally:
+            if writer is not None:
+                writer.close()
+
+        if filas_totales == 0:
+            if not particionar_por_ticker and os.path.exists(ruta_final):
+                os.remove(ruta_final)  # no dejar un archivo vacío cuando no se exportó nada
+            return f"No se encontraron datos para exportar de {', '.join(tickers)} en la fuente '{fuente}'."
+
+        detalle = ", ".join(f"{t}: {n}" for t, n in filas_por_ticker.items())
+        return f"Datos exportados exitosamente a {ruta_final} ({formato}, {filas_totales} filas; {detalle})."
+
+    except Exception as e:
+        return f"Error al exportar datos a formato columnar: {str(e)}"
+
+def leer_historico_columnar(ruta: str, tickers: Optional[List[str]] = None,
+                            columnas: Optional[List[str]] = None):
+    """
+    Lee una exportación de exportar_historico_columnar (archivo o directorio particionado)
+    usando memory-map, de modo que solo se cargan las columnas y tickers solicitados.
+
+    Returns:
+        pyarrow.Table: Tabla Arrow; usa .to_pandas() si necesitas un DataFrame.
+    """
+    _, _, ds, pafs = _importar_pyarrow()
+    formato = "ipc" if ruta.endswith(".feather") or (
+        os.path.isdir(ruta) and any(f.endswith(".feather") for _, _, fs in os.walk(ruta) for f in fs)
+    ) else "parquet"
+    dataset = ds.dataset(ruta, format=formato, partitioning="hive",
+                         filesystem=pafs.LocalFileSystem(use_mmap=True))
+    filtro = ds.field("ticker").isin(tickers) if tickers else None
+    return dataset.to_table(columns=columnas, filter=filtro)
+
 @tool
-def graficar_retorno_series(retornos: List[float], titulo: str = "Serie temporal de retornos porcentuales") -> str:
+def graficar_retorno_series(retornos: Optional[List[float]] = None,
+                            titulo: str = "Serie temporal de retornos porcentuales",
+                            ticker: Optional[str] = None, dias: int = 90) -> str:
     """
     Grafica la serie temporal de retornos porcentuales.
-    Guarda la gráfica como 'grafico_retorno.png' y devuelve el nombre del archivo o un mensaje de error.
+    Guarda la gráfica como 'grafico_retorno_<id>.png' y devuelve el nombre del archivo o un mensaje de error.
     
     Args:
         retornos (List[float]): Lista de retornos porcentuales a graficar.
         titulo (str): Título para la gráfica.
+        ticker (str, opcional): Si no se pasan retornos, se grafican los retornos diarios del cierre
+                                precalculados en la base de datos para este ticker.
+        dias (int): Sesiones recientes a leer cuando se usa 'ticker'.
     
     Returns:
         str: Ruta del archivo PNG generado o mensaje de error.
     """
     try:
+        if not retornos and ticker:
+            df = _leer_indicadores(ticker, ["ret_simple"], dias)
+            retornos = [r * 100 for r in df["ret_simple"].dropna()]
+
         if not retornos or not isinstance(retornos, list):
             return "Error: La lista de retornos está vacía o no es válida para graficar."
 
@@ -356,19 +998,20 @@ def graficar_retorno_series(retornos: List[float], titulo: str = "Serie temporal
         if not retornos_numericos:
             return "Error: No hay datos numéricos válidos en la lista de retornos para graficar."
 
-        plt.figure(figsize=(12, 7)) # Tamaño de figura más grande
-        plt.plot(retornos_numericos, label="Retornos %", color='teal', linewidth=1.5)
-        plt.xlabel("Periodo", fontsize=12)
-        plt.ylabel("Retorno (%)", fontsize=12)
-        plt.title(titulo, fontsize=14)
-        plt.legend(fontsize=10)
-        plt.grid(True, linestyle='--', alpha=0.7)
-        plt.axhline(0, color='gray', linestyle='--', linewidth=0.8) # Línea en 0%
-        plt.tight_layout()
-
-        nombre_archivo = "grafico_retorno.png"
-        plt.savefig(nombre_archivo, dpi=300) # Mejorar la resolución
-        plt.close()
+        fig = Figure(figsize=(12, 7)) # Tamaño de figura más grande
+        ax = fig.subplots()
+        ax.plot(retornos_numericos, label="Retornos %", color='teal', linewidth=1.5)
+        ax.set_xlabel("Periodo", fontsize=12)
+        ax.set_ylabel("Retorno (%)", fontsize=12)
+        ax.set_title(titulo, fontsize=14)
+        ax.legend(fontsize=10)
+        ax.grid(True, linestyle='--', alpha=0.7)
+        ax.axhline(0, color='gray', linestyle='--', linewidth=0.8) # Línea en 0%
+        fig.tight_layout()
+
+        nombre_archivo = _nombre_grafico("grafico_retorno")
+        with span("render", "matplotlib.savefig", dpi=300):
+            fig.savefig(nombre_archivo, dpi=300) # Mejorar la resolución
 
         return nombre_archivo
 
@@ -420,11 +1063,14 @@ def _execute_sql(sql_query: str, params=None, fetch_one=False, fetch_all=False):
     try:
         conn = _get_db_connection()
         cur = conn.cursor()
-        cur.execute(sql_query, params)
-        if fetch_one:
-            return cur.fetchone()
-        if fetch_all:
-            return cur.fetchall()
+        with span("sql", sql_query.split()[0].upper()) as attrs:
+            cur.execute(sql_query, params)
+            if fetch_one:
+                return cur.fetchone()
+            if fetch_all:
+                filas = cur.fetchall()
+                attrs["filas"] = len(filas)
+                return filas
         conn.commit() # Asegurarse de que los cambios se guarden
     except Exception as e:
         if conn:
@@ -435,19 +1081,247 @@ def _execute_sql(sql_query: str, params=None, fetch_one=False, fetch_all=False):
             _return_db_connection(conn)
 
 
+# --- Indicadores derivados (tabla historical_indicators) ---
+
+# Ventana más larga de los indicadores: cuántas filas previas hacen falta para recalcular
+VENTANA_MAX_INDICADORES = 50
+COLUMNAS_INDICADORES = ("ret_simple", "ret_log", "ret_low", "sma_20", "sma_50", "vol_20")
+
+def _actualizar_indicadores(cur, ticker: str, desde) -> int:
+    """
+    Recalcula los indicadores de 'ticker' a partir de la fecha 'desde' (la más antigua recién
+    guardada) y los inserta/actualiza en historical_indicators. Solo lee las
+    VENTANA_MAX_INDICADORES filas anteriores como contexto de las ventanas móviles.
+    Si hay precios más antiguos sin indicadores (guardados antes de existir la tabla), se rellenan también.
+
+    Returns:
+        int: Número de filas de indicadores escritas.
+    """
+    with span("sql", "CREATE TABLE historical_indicators"):
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS historical_indicators (
+            ticker VARCHAR(50) NOT NULL,
+            date DATE NOT NULL,
+            ret_simple DOUBLE PRECISION,  -- retorno simple diario del cierre
+            ret_log DOUBLE PRECISION,     -- retorno logarítmico diario del cierre
+            ret_low DOUBLE PRECISION,     -- retorno simple diario del mínimo (Low)
+            sma_20 DOUBLE PRECISION,      -- media móvil de 20 sesiones del cierre
+            sma_50 DOUBLE PRECISION,      -- media móvil de 50 sesiones del cierre
+            vol_20 DOUBLE PRECISION,      -- desviación típica de 20 sesiones de ret_simple
+            PRIMARY KEY (ticker, date)
+        );
+        """)
+
+    desde = pd.Timestamp(desde).date()
+    with span("sql", "SELECT max(date) historical_indicators"):
+        cur.execute("SELECT max(date) FROM historical_indicators WHERE ticker = %s", (ticker,))
+        ultima = cur.fetchone()[0]
+    if ultima is None:
+        desde = None  # sin indicadores previos: se calculan para todo el histórico
+    elif pd.Timestamp(ultima).date() < desde:
+        desde = (pd.Timestamp(ultima) + pd.Timedelta(days=1)).date()
+
+    with span("sql", "SELECT historical_prices (indicadores)") as attrs:
+        if desde is None:
+            cur.execute("SELECT date, close, low FROM historical_prices WHERE ticker = %s ORDER BY date", (ticker,))
+        else:
+            cur.execute("""
+                SELECT date, close, low FROM (
+                    SELECT date, close, low FROM historical_prices
+                    WHERE ticker = %s AND date < %s
+                    ORDER BY date DESC LIMIT %s
+                ) previas
+                UNION ALL
+                SELECT date, close, low FROM historical_prices
+                WHERE ticker = %s AND date >= %s
+                ORDER BY date
+            """, (ticker, desde, VENTANA_MAX_INDICADORES, ticker, desde))
+        filas = cur.fetchall()
+        attrs["filas"] = len(filas)
+    if not filas:
+        return 0
+
+    df = pd.DataFrame(filas, columns=["date", "close", "low"])
+    df["date"] = pd.to_datetime(df["date"]).dt.date
+    df[["close", "low"]] = df[["close", "low"]].astype("float64")
+    close = df["close"]
+    df["ret_simple"] = close.pct_change()
+    df["ret_log"] = np.log(close).diff()
+    df["ret_low"] = df["low"].pct_change()
+    df["sma_20"] = close.rolling(20).mean()
+    df["sma_50"] = close.rolling(50).mean()
+    df["vol_20"] = df["ret_simple"].rolling(20).std()
+    if desde is not None:
+        df = df[df["date"] >= desde]
+
+    columnas = ["date", *COLUMNAS_INDICADORES]
+    df = df[columnas].replace([np.inf, -np.inf], np.nan).astype(object)
+    df = df.where(pd.notna(df), None)
+    registros = [(ticker, *fila) for fila in df.itertuples(index=False, name=None)]
+
+    with span("sql", "UPSERT historical_indicators", filas=len(registros)):
+        cur.executemany("""
+        INSERT INTO historical_indicators (ticker, date, ret_simple, ret_log, ret_low, sma_20, sma_50, vol_20)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (ticker, date) DO UPDATE SET
+            ret_simple = EXCLUDED.ret_simple,
+            ret_log = EXCLUDED.ret_log,
+            ret_low = EXCLUDED.ret_low,
+            sma_20 = EXCLUDED.sma_20,
+            sma_50 = EXCLUDED.sma_50,
+            vol_20 = EXCLUDED.vol_20;
+        """, registros)
+    return len(registros)
+
+def _leer_indicadores(ticker: str, columnas: List[str], dias: int = 30,
+                      fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> pd.DataFrame:
+    """
+    Lee indicadores precalculados con una única consulta por rango sobre la clave (ticker, date):
+    entre fecha_inicio y fecha_fin si se indica fecha_inicio, o las últimas 'dias' filas hasta
+    fecha_fin (o hasta hoy si no se indica).
+    """
+    invalidas = [c for c in columnas if c not in COLUMNAS_INDICADORES]
+    if invalidas:
+        raise ValueError(f"Indicadores no soportados: {', '.join(invalidas)}. Disponibles: {', '.join(COLUMNAS_INDICADORES)}")
+    lista = ", ".join(columnas)  # seguro: validadas contra COLUMNAS_INDICADORES
+    if fecha_inicio:
+        filas = _execute_sql(
+            f"SELECT date, {lista} FROM historical_indicators WHERE ticker = %s AND date BETWEEN %s AND %s ORDER BY date",
+            (ticker, fecha_inicio, fecha_fin or datetime.utcnow().strftime('%Y-%m-%d')), fetch_all=True)
+    elif fecha_fin:
+        filas = _execute_sql(
+            f"SELECT date, {lista} FROM historical_indicators WHERE ticker = %s AND date <= %s ORDER BY date DESC LIMIT %s",
+            (ticker, fecha_fin, dias), fetch_all=True)
+        filas = list(reversed(filas or []))
+    else:
+        filas = _execute_sql(
+            f"SELECT date, {lista} FROM historical_indicators WHERE ticker = %s ORDER BY date DESC LIMIT %s",
+            (ticker, dias), fetch_all=True)
+        filas = list(reversed(filas or []))
+    df = pd.DataFrame(filas or [], columns=["date", *columnas])
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime('%Y-%m-%d')
+    return df
+
 @tool
-def save_historical_data_to_db(ticker: str, data: List[Dict[str, Any]]) -> str:
+def obtener_indicadores(ticker: str, dias: int = 30, indicadores: Optional[List[str]] = None,
+                        fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> str:
     """
-    Guarda datos históricos de precios de un activo en una tabla de PostgreSQL.
-    Crea la tabla si no existe. La tabla se llamará 'historical_prices'.
+    Lee de la base de datos los indicadores precalculados de un activo ya guardado,
+    sin volver a descargar precios.
 
     Args:
-        ticker (str): El símbolo del ticker del activo (ej. 'BTC-USD', 'AAPL').
-        data (List[Dict[str, Any]]): Una lista de diccionarios, donde cada diccionario
-                                     representa una fila de datos históricos
-                                     (ej. {'Date': 'YYYY-MM-DD', 'Open': ..., 'High': ..., ...}).
+        ticker (str): Ticker tal como se guardó (ej. 'BTC-USD').
+        dias (int): Número de sesiones hasta fecha_fin, o hasta hoy si no se indica (se ignora si se indica fecha_inicio).
+        indicadores (List[str], opcional): Subconjunto de ret_simple, ret_log, ret_low, sma_20, sma_50, vol_20.
+            Los retornos y la volatilidad están en fracción (0.01 = 1%).
+        fecha_inicio (str, opcional): Fecha inicial 'YYYY-MM-DD'.
+        fecha_fin (str, opcional): Fecha final 'YYYY-MM-DD'.
+
     Returns:
-        str: Un mensaje de confirmación o error.
+        str: JSON string con una fila por fecha, o un mensaje de error.
+    """
+    try:
+        df = _leer_indicadores(ticker, list(indicadores or COLUMNAS_INDICADORES), dias, fecha_inicio, fecha_fin)
+        if df.empty:
+            return json.dumps({"error": f"No hay indicadores guardados para {ticker}. Guarda antes su histórico en la base de datos."}, ensure_ascii=False, indent=2)
+        df = df.astype(object).where(df.notna(), None)
+        return json.dumps(df.to_dict(orient="records"), ensure_ascii=False, indent=2)
+    except Exception as e:
+        return json.dumps({"error": f"Error al leer indicadores de {ticker}: {str(e)}"}, ensure_ascii=False, indent=2)
+
+# --- Agregaciones en SQL sobre historical_prices ---
+
+# Periodos admitidos -> expresión SQL del periodo (lista blanca: nunca se interpola texto del usuario)
+PERIODOS_AGREGACION = {
+    "dia": "date",
+    "semana": "date_trunc('week', date)::date",
+    "mes": "date_trunc('month', date)::date",
+    "trimestre": "date_trunc('quarter', date)::date",
+    "anio": "date_trunc('year', date)::date",
+    "total": None,
+}
+MAX_FILAS_AGREGACION = 500
+
+def _valor_json(valor):
+    """Convierte Decimal/fecha de psycopg2 a tipos serializables en JSON."""
+    if valor is None or isinstance(valor, (int, str)):
+        return valor
+    if hasattr(valor, "isoformat"):
+        return valor.isoformat()
+    return round(float(valor), 6)
+
+@tool
+def consultar_historico_db(tickers: List[str], periodo: str = "mes", dias: int = 365,
+                           fecha_inicio: Optional[str] = None, fecha_fin: Optional[str] = None) -> str:
+    """
+    Resume los precios ya guardados en la base de datos sin volver a descargarlos: la agregación
+    (OHLC por periodo, media del cierre, mínimos/máximos y volumen total) se calcula en PostgreSQL
+    y solo se devuelve el resultado agregado.
+
+    Args:
+        tickers (List[str]): Tickers tal como se guardaron (ej. ['BTC-USD', 'AAPL']).
+        periodo (str): 'dia', 'semana', 'mes', 'trimestre', 'anio' o 'total' (una fila por ticker).
+        dias (int): Días hacia atrás desde fecha_fin, o desde hoy si no se indica (se ignora si se indica fecha_inicio).
+        fecha_inicio (str, opcional): Fecha inicial 'YYYY-MM-DD'.
+        fecha_fin (str, opcional): Fecha final 'YYYY-MM-DD' (por defecto, hoy).
+
+    Returns:
+        str: JSON string con una fila por ticker y periodo, o un mensaje de error.
+    """
+    if periodo not in PERIODOS_AGREGACION:
+        return json.dumps({"error": f"Periodo '{periodo}' no soportado. Usa uno de: {', '.join(PERIODOS_AGREGACION)}"}, ensure_ascii=False, indent=2)
+    if not tickers:
+        return json.dumps({"error": "Indica al menos un ticker."}, ensure_ascii=False, indent=2)
+
+    expresion = PERIODOS_AGREGACION[periodo]
+    columna_periodo = f"{expresion} AS periodo, " if expresion else ""
+    agrupacion = "ticker, periodo" if expresion else "ticker"
+    try:
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date() if fecha_fin else datetime.utcnow().date()
+        # Sin fecha_inicio, 'dias' cuenta hacia atrás desde fecha_fin (o desde hoy)
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date() if fecha_inicio else fin - timedelta(days=int(dias))
+    except ValueError as e:
+        return json.dumps({"error": f"Fecha inválida (usa el formato YYYY-MM-DD): {str(e)}"}, ensure_ascii=False, indent=2)
+    filtro_fechas = "date BETWEEN %s AND %s"
+    params = [list(tickers), inicio, fin]
+
+    # Apertura y cierre del periodo: primer y último valor ordenados por fecha dentro del grupo
+    sql = f"""
+        SELECT ticker, {columna_periodo}
+               (array_agg(open ORDER BY date))[1] AS open,
+               max(high) AS high,
+               min(low) AS low,
+               (array_agg(close ORDER BY date DESC))[1] AS close,
+               avg(close) AS close_medio,
+               sum(volume) AS volume,
+               count(*) AS sesiones,
+               min(date) AS desde,
+               max(date) AS hasta
+        FROM historical_prices
+        WHERE ticker = ANY(%s) AND {filtro_fechas}
+        GROUP BY {agrupacion}
+        ORDER BY {agrupacion}
+        LIMIT {MAX_FILAS_AGREGACION + 1}
+    """
+    columnas = ["ticker", *(["periodo"] if expresion else []), "open", "high", "low", "close",
+                "close_medio", "volume", "sesiones", "desde", "hasta"]
+    try:
+        filas = _execute_sql(sql, tuple(params), fetch_all=True) or []
+    except Exception as e:
+        return json.dumps({"error": f"Error al consultar la base de datos: {str(e)}"}, ensure_ascii=False, indent=2)
+
+    if not filas:
+        return json.dumps({"error": f"No hay precios guardados para {', '.join(tickers)} en ese rango."}, ensure_ascii=False, indent=2)
+    resultado = [{c: _valor_json(v) for c, v in zip(columnas, fila)} for fila in filas[:MAX_FILAS_AGREGACION]]
+    if len(filas) > MAX_FILAS_AGREGACION:
+        return json.dumps({"aviso": f"Resultado truncado a {MAX_FILAS_AGREGACION} filas; usa un periodo mayor o un rango menor.",
+                           "filas": resultado}, ensure_ascii=False, indent=2)
+    return json.dumps(resultado, ensure_ascii=False, indent=2)
+
+def guardar_historico(ticker: str, data: List[Dict[str, Any]]) -> str:
+    """
+    Implementación de save_historical_data_to_db, invocable directamente desde código
+    (por ejemplo, desde la cola de persistencia en segundo plano de persistence.py).
     """
     if not data:
         return "No hay datos para guardar en la base de datos."
@@ -473,7 +1347,8 @@ def save_historical_data_to_db(ticker: str, data: List[Dict[str, Any]]) -> str:
             UNIQUE (ticker, date) -- Evitar duplicados para un mismo ticker y fecha
         );
         """
-        cur.execute(create_table_query)
+        with span("sql", "CREATE TABLE historical_prices"):
+            cur.execute(create_table_query)
 
         # Preparar la inserción de datos
         # Asumiendo que 'data' contiene diccionarios con claves como 'Date', 'Open', etc.
@@ -528,11 +1403,16 @@ def save_historical_data_to_db(ticker: str, data: List[Dict[str, Any]]) -> str:
                 source
             ))
 
-        cur.executemany(insert_query, records_to_insert)
-        conn.commit()
+        with span("sql", "UPSERT historical_prices", filas=len(records_to_insert)):
+            cur.executemany(insert_query, records_to_insert)
         num_rows_inserted = cur.rowcount
+
+        # Indicadores derivados en la misma transacción, solo desde la fecha más antigua tocada
+        num_indicadores = _actualizar_indicadores(cur, ticker, min(r[1] for r in records_to_insert))
+        conn.commit()
         cur.close()
-        return f"Datos históricos para '{ticker}' guardados/actualizados exitosamente en PostgreSQL. {num_rows_inserted} filas afectadas."
+        return (f"Datos históricos para '{ticker}' guardados/actualizados exitosamente en PostgreSQL. "
+                f"{num_rows_inserted} filas afectadas, {num_indicadores} filas de indicadores actualizadas.")
 
     except Exception as e:
         if conn:
@@ -542,6 +1422,22 @@ def save_historical_data_to_db(ticker: str, data: List[Dict[str, Any]]) -> str:
         if conn:
             _return_db_connection(conn)
 
+@tool
+def save_historical_data_to_db(ticker: str, data: List[Dict[str, Any]]) -> str:
+    """
+    Guarda datos históricos de precios de un activo en una tabla de PostgreSQL.
+    Crea la tabla si no existe. La tabla se llamará 'historical_prices'.
+
+    Args:
+        ticker (str): El símbolo del ticker del activo (ej. 'BTC-USD', 'AAPL').
+        data (List[Dict[str, Any]]): Una lista de diccionarios, donde cada diccionario
+                                     representa una fila de datos históricos
+                                     (ej. {'Date': 'YYYY-MM-DD', 'Open': ..., 'High': ..., ...}).
+    Returns:
+        str: Un mensaje de confirmación o error.
+    """
+    return guardar_historico(ticker, data)
+
  # Si tienes una lista 'toolkit' global
 # O simplemente asegúrate de que esté disponible para el agente adecuado.
 
@@ -555,8 +1451,12 @@ toolkit = [
     obtener_historico_precios_coingecko_tool,
     obtener_historico_precios_tool,
     guardar_datos_json,
+    exportar_historico_columnar,
     save_historical_data_to_db,
+    obtener_indicadores,
+    consultar_historico_db,
     calcular_retorno_low_series,
     obtener_y_graficar,
+    graficar_comparacion,
     graficar_retorno_series
 ]
\ No newline at end of file
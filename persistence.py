@@ -0,0 +1,175 @@
+# persistence.py
+"""
+Persistencia en segundo plano de los históricos detectados en las respuestas del chat.
+
+app.py encola los registros y sigue respondiendo; un hilo escritor agrupa lo encolado
+en lotes por ticker y solo escribe en PostgreSQL las filas nuevas o modificadas:
+
+    - marca de agua por ticker: la fecha más reciente ya guardada; lo posterior es nuevo.
+    - hash de contenido por (ticker, fecha): las filas antiguas solo se reescriben si
+      sus valores cambiaron. Para fechas que el proceso aún no conoce, el hash se
+      siembra con una única consulta a la base de datos por lote.
+
+estado() devuelve contadores y el último resultado para mostrarlos en la interfaz.
+"""
+
+import hashlib
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from my_tools import _execute_sql, guardar_historico
+
+_CAMPOS = ("Open", "High", "Low", "Close", "Adj Close", "Volume")
+
+def _normalizar(campo: str, v):
+    """Valor comparable entre DataFrame y DB: Volume como entero (BIGINT), el resto a 6 decimales."""
+    if v is None or v != v:  # None o NaN
+        return None
+    return int(round(float(v))) if campo == "Volume" else round(float(v), 6)
+
+def _hash_fila(valores) -> str:
+    """Hash estable de los valores de una fila (en el orden de _CAMPOS)."""
+    normalizados = tuple(_normalizar(c, v) for c, v in zip(_CAMPOS, valores))
+    return hashlib.blake2b(repr(normalizados).encode(), digest_size=16).hexdigest()
+
+
+class ColaPersistencia:
+    """Cola de escritura con un hilo daemon que persiste por lotes solo los cambios."""
+
+    def __init__(self, max_filas_lote: int = 5000, espera_lote_seg: float = 0.5):
+        self.max_filas_lote = max_filas_lote
+        self.espera_lote_seg = espera_lote_seg
+        self._cola: "queue.Queue[tuple]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._marca_agua: Dict[str, str] = {}
+        self._hashes: Dict[str, Dict[str, str]] = {}
+        self._estado = {
+            "pendientes": 0, "escritas": 0, "omitidas": 0, "lotes": 0, "errores": 0,
+            "ultimo_resultado": None, "ultima_escritura": None,
+        }
+        self._hilo = threading.Thread(target=self._bucle, name="persistencia", daemon=True)
+        self._hilo.start()
+
+    def encolar(self, ticker: str, registros: List[Dict[str, Any]]) -> int:
+        """Encola registros con formato de obtener_historico_precios sin bloquear. Devuelve cuántos se encolaron."""
+        validos = [r for r in registros if isinstance(r, dict) and r.get("Date")]
+        if validos:
+            with self._lock:
+                self._estado["pendientes"] += len(validos)
+            self._cola.put((ticker, validos))
+        return len(validos)
+
+    def estado(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._estado)
+
+    def esperar_vacia(self, timeout: float = 30.0) -> bool:
+        """Espera a que no queden filas pendientes (útil en scripts y pruebas)."""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            if self.estado()["pendientes"] == 0:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def _siguiente_lote(self):
+        """
+        Bloquea hasta el primer elemento y agrupa lo que llegue durante espera_lote_seg, por ticker y fecha.
+        Devuelve el lote y el número de registros consumidos de la cola.
+        """
+        lote: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        ticker, registros = self._cola.get()
+        filas = 0
+        limite = time.monotonic() + self.espera_lote_seg
+        while True:
+            por_fecha = lote.setdefault(ticker, {})
+            for r in registros:
+                por_fecha[r["Date"]] = r  # el registro más reciente de una fecha gana
+            filas += len(registros)
+            restante = limite - time.monotonic()
+            if filas >= self.max_filas_lote or restante <= 0:
+                break
+            try:
+                ticker, registros = self._cola.get(timeout=restante)
+            except queue.Empty:
+                break
+        return lote, filas
+
+    def _sembrar(self, ticker: str, fechas: List[str]) -> None:
+        """Carga la marca de agua y los hashes guardados en la base de datos para las fechas desconocidas."""
+        hashes = self._hashes.setdefault(ticker, {})
+        if ticker not in self._marca_agua:
+            try:
+                fila = _execute_sql("SELECT max(date) FROM historical_prices WHERE ticker = %s", (ticker,), fetch_one=True)
+                maxima = fila[0] if fila else None
+            except Exception:
+                maxima = None  # la tabla aún no existe: todo es nuevo
+            self._marca_agua[ticker] = str(maxima) if maxima else ""
+
+        marca = self._marca_agua[ticker]
+        desconocidas = [f for f in fechas if f <= marca and f not in hashes]
+        if not desconocidas:
+            return
+        filas = _execute_sql(
+            """
+            SELECT date, open, high, low, close, adj_close, volume
+            FROM historical_prices
+            WHERE ticker = %s AND date BETWEEN %s AND %s
+            """,
+            (ticker, min(desconocidas), max(desconocidas)), fetch_all=True) or []
+        for fecha, *valores in filas:
+            hashes.setdefault(str(fecha), _hash_fila(valores))
+
+    def _escribir_ticker(self, ticker: str, por_fecha: Dict[str, Dict[str, Any]]) -> None:
+        self._sembrar(ticker, list(por_fecha))
+        hashes = self._hashes[ticker]
+        marca = self._marca_agua[ticker]
+
+        cambios, nuevos_hashes = [], {}
+        for fecha, registro in sorted(por_fecha.items()):
+            h = _hash_fila(registro.get(c) for c in _CAMPOS)
+            if fecha > marca or hashes.get(fecha) != h:
+                cambios.append(registro)
+                nuevos_hashes[fecha] = h
+
+        omitidas = len(por_fecha) - len(cambios)
+        if cambios:
+            resultado = guardar_historico(ticker, cambios)
+            if resultado.startswith("Error") or resultado.startswith("Formato"):
+                raise RuntimeError(resultado)
+            hashes.update(nuevos_hashes)
+            self._marca_agua[ticker] = max(marca, cambios[-1]["Date"])
+
+        with self._lock:
+            self._estado["escritas"] += len(cambios)
+            self._estado["omitidas"] += omitidas
+            self._estado["ultimo_resultado"] = f"{ticker}: {len(cambios)} filas escritas, {omitidas} sin cambios."
+            self._estado["ultima_escritura"] = time.strftime("%H:%M:%S")
+
+    def _bucle(self):
+        while True:
+            lote, consumidas = self._siguiente_lote()
+            for ticker, por_fecha in lote.items():
+                try:
+                    self._escribir_ticker(ticker, por_fecha)
+                except Exception as e:
+                    with self._lock:
+                        self._estado["errores"] += 1
+                        self._estado["ultimo_resultado"] = f"Error al persistir '{ticker}': {e}"
+            with self._lock:
+                self._estado["lotes"] += 1
+                self._estado["pendientes"] = max(0, self._estado["pendientes"] - consumidas)
+
+
+_cola: Optional[ColaPersistencia] = None
+_cola_lock = threading.Lock()
+
+def obtener_cola() -> ColaPersistencia:
+    """Devuelve la cola de persistencia del proceso, creándola la primera vez."""
+    global _cola
+    with _cola_lock:
+        if _cola is None:
+            _cola = ColaPersistencia()
+        return _cola
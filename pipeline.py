@@ -0,0 +1,128 @@
+# pipeline.py
+"""
+Núcleo headless del chat: construcción del agente ReAct con el toolkit completo
+y ejecución de una consulta. Lo comparten app.py (Streamlit) y los demás puntos
+de entrada que no tienen interfaz (benchmarks, pruebas de carga, etc.).
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langgraph.prebuilt import create_react_agent
+from langgraph.checkpoint.memory import MemorySaver
+
+from my_tools import toolkit
+from telemetry import ManejadorTelemetria
+
+SYSTEM_PROMPT = """
+Eres un asistente experto en análisis financiero, criptomonedas y mercados bursátiles.
+Usa las herramientas disponibles y responde de forma clara y concisa.
+"""
+
+MEMORIA_MAX_HILOS = int(os.getenv("MEMORIA_MAX_HILOS", "1000"))
+MEMORIA_TTL_SEG = float(os.getenv("MEMORIA_TTL_SEG", "3600"))
+
+
+class MemoriaAcotada(MemorySaver):
+    """
+    MemorySaver que olvida conversaciones: como mucho 'max_hilos' threads, y ninguno sin
+    escrituras durante más de 'ttl_seg' segundos. Sin límite, cada consulta con un thread
+    nuevo (API, lotes) dejaría su historial, con las salidas JSON de las herramientas, en RAM para siempre.
+    """
+
+    def __init__(self, max_hilos: int = MEMORIA_MAX_HILOS, ttl_seg: float = MEMORIA_TTL_SEG):
+        super().__init__()
+        self.max_hilos = max(1, max_hilos)
+        self.ttl_seg = ttl_seg
+        self._ultimo_uso: "OrderedDict[str, float]" = OrderedDict()
+        self._lock_hilos = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        # aput() delega en put(), así que esto cubre también el camino asíncrono
+        resultado = super().put(config, checkpoint, metadata, new_versions)
+        self._tocar(config["configurable"]["thread_id"])
+        return resultado
+
+    def _tocar(self, thread_id: str):
+        ahora = time.monotonic()
+        expulsados = []
+        with self._lock_hilos:
+            self._ultimo_uso[thread_id] = ahora
+            self._ultimo_uso.move_to_end(thread_id)
+            while self._ultimo_uso and (len(self._ultimo_uso) > self.max_hilos
+                                        or next(iter(self._ultimo_uso.values())) < ahora - self.ttl_seg):
+                expulsados.append(self._ultimo_uso.popitem(last=False)[0])
+        for viejo in expulsados:
+            self.delete_thread(viejo)
+
+def crear_agente(llm, checkpointer=None):
+    """
+    Crea el agente ReAct con todas las herramientas de my_tools.toolkit.
+    Si no se indica checkpointer, la memoria de conversación se guarda en RAM, acotada (MemoriaAcotada).
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("human", "{messages}")
+    ])
+    return create_react_agent(llm, toolkit, checkpointer=checkpointer or MemoriaAcotada(), prompt=prompt)
+
+def _eventos_paso(step: dict) -> List[Dict[str, Any]]:
+    """Convierte un paso de agent.stream() en eventos: salidas de herramientas y respuesta del agente."""
+    eventos = []
+    # Capturar salidas de herramientas
+    for msg in step.get("tools", {}).get("messages", []):
+        if isinstance(msg, ToolMessage):
+            text = msg.content.strip()
+            # Una herramienta de gráficos puede devolver la ruta del PNG seguida de notas en otras líneas
+            ruta = text.splitlines()[0].strip() if text else ""
+            es_imagen = ruta.lower().endswith(".png") and os.path.exists(ruta)
+            eventos.append({"tipo": "herramienta", "nombre": msg.name, "contenido": text,
+                            "imagen": ruta if es_imagen else None})
+
+    # Capturar la respuesta final del agente
+    for msg in reversed(step.get("agent", {}).get("messages", [])):
+        if isinstance(msg, AIMessage) and msg.content:
+            eventos.append({"tipo": "respuesta", "contenido": msg.content})
+            break
+    return eventos
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}, "callbacks": [ManejadorTelemetria()]}
+
+def ejecutar_consulta(agent, query: str, thread_id: str = "chat1") -> Tuple[str, List[str], List[str]]:
+    """
+    Ejecuta una consulta contra el agente y recoge la respuesta.
+    Las llamadas al LLM y a las herramientas quedan registradas como spans de telemetría.
+
+    Returns:
+        Tuple[str, List[str], List[str]]: Texto final del agente, rutas de imágenes PNG
+        generadas y salidas en bruto de las herramientas.
+    """
+    final_text = ""
+    images: List[str] = []
+    tool_outputs: List[str] = []
+
+    for step in agent.stream({"messages": [HumanMessage(content=query)]}, config=_config(thread_id)):
+        for evento in _eventos_paso(step):
+            if evento["tipo"] == "herramienta":
+                tool_outputs.append(evento["contenido"])
+                if evento["imagen"]:
+                    images.append(evento["imagen"])
+            else:
+                final_text = evento["contenido"]
+
+    return final_text, images, tool_outputs
+
+async def transmitir_consulta(agent, query: str, thread_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Versión asíncrona de ejecutar_consulta que emite cada evento en cuanto se produce
+    ({"tipo": "herramienta", ...} o {"tipo": "respuesta", ...}), para respuestas en streaming.
+    """
+    async for step in agent.astream({"messages": [HumanMessage(content=query)]}, config=_config(thread_id)):
+        for evento in _eventos_paso(step):
+            yield evento
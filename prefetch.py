@@ -0,0 +1,135 @@
+# prefetch.py
+"""
+Precarga periódica de los históricos de una watchlist de activos.
+
+Un hilo en segundo plano refresca cada cierto intervalo los históricos de los
+tickers de Yahoo Finance y de las criptomonedas de CoinGecko más consultados,
+dejándolos en la caché en memoria de my_tools.py. Así las consultas interactivas
+sobre esos activos se sirven sin salir a la red.
+
+Todas las descargas pasan por los mismos limitadores de tasa que usan las
+herramientas, por lo que el prefetch nunca supera los límites de las APIs.
+
+Configuración (variables de entorno):
+    PREFETCH_ACTIVO            "1" para arrancar el hilo desde app.py (por defecto "0", desactivado).
+    WATCHLIST_YAHOO            Tickers de Yahoo separados por comas.
+    WATCHLIST_COINGECKO        IDs de CoinGecko separados por comas.
+    PREFETCH_DIAS_COINGECKO    Ventanas (en días) a precargar para CoinGecko, separadas por comas.
+                               Las ventanas más cortas se sirven desde la misma caché diaria.
+    PREFETCH_INTERVALO_SEG     Segundos entre ciclos de refresco.
+"""
+
+import os
+import threading
+import time
+from typing import List, Optional
+
+from my_tools import (
+    HISTORIAL_TTL_SEG,
+    refrescar_historial_yahoo,
+    refrescar_historial_coingecko,
+)
+
+def _leer_lista(variable: str, por_defecto: str) -> List[str]:
+    """Lee una lista separada por comas desde una variable de entorno."""
+    return [x.strip() for x in os.getenv(variable, por_defecto).split(",") if x.strip()]
+
+WATCHLIST_YAHOO = _leer_lista("WATCHLIST_YAHOO", "BTC-USD,ETH-USD,SOL-USD,AAPL,MSFT,NVDA,TSLA,SPY")
+WATCHLIST_COINGECKO = _leer_lista("WATCHLIST_COINGECKO", "bitcoin,ethereum,solana")
+PREFETCH_DIAS_COINGECKO = [int(d) for d in _leer_lista("PREFETCH_DIAS_COINGECKO", "365")]
+# Por defecto refrescamos antes de que caduque la caché para no dejar huecos fríos
+PREFETCH_INTERVALO_SEG = float(os.getenv("PREFETCH_INTERVALO_SEG", str(HISTORIAL_TTL_SEG * 0.8)))
+
+
+class PrefetchWatchlist(threading.Thread):
+    """Hilo daemon que refresca la watchlist cada 'intervalo' segundos."""
+
+    def __init__(self,
+                 tickers_yahoo: List[str],
+                 coins_coingecko: List[str],
+                 dias_coingecko: List[int],
+                 intervalo: float):
+        super().__init__(name="prefetch-watchlist", daemon=True)
+        self.tickers_yahoo = tickers_yahoo
+        self.coins_coingecko = coins_coingecko
+        self.dias_coingecko = dias_coingecko
+        self.intervalo = intervalo
+        self._detener = threading.Event()
+        self.ultimo_ciclo: Optional[dict] = None
+
+    def ejecutar_ciclo(self) -> dict:
+        """
+        Refresca una vez todos los activos de la watchlist.
+        Un fallo en un activo no interrumpe el resto del ciclo.
+        """
+        inicio = time.monotonic()
+        refrescados, errores = 0, []
+
+        for ticker in self.tickers_yahoo:
+            if self._detener.is_set():
+                break
+            try:
+                refrescar_historial_yahoo(ticker)
+                refrescados += 1
+            except Exception as e:
+                errores.append(f"{ticker}: {e}")
+
+        for coin_id in self.coins_coingecko:
+            for dias in self.dias_coingecko:
+                if self._detener.is_set():
+                    break
+                try:
+                    refrescar_historial_coingecko(coin_id, dias)
+                    refrescados += 1
+                except Exception as e:
+                    errores.append(f"{coin_id} ({dias}d): {e}")
+
+        self.ultimo_ciclo = {
+            "refrescados": refrescados,
+            "errores": errores,
+            "duracion_seg": round(time.monotonic() - inicio, 2),
+        }
+        return self.ultimo_ciclo
+
+    def run(self):
+        while not self._detener.is_set():
+            resumen = self.ejecutar_ciclo()
+            if resumen["errores"]:
+                print(f"Prefetch de watchlist con errores: {resumen['errores']}")
+            self._detener.wait(self.intervalo)
+
+    def detener(self):
+        """Pide al hilo que termine tras el activo en curso."""
+        self._detener.set()
+
+
+_prefetch: Optional[PrefetchWatchlist] = None
+_prefetch_lock = threading.Lock()
+
+def iniciar_prefetch() -> Optional[PrefetchWatchlist]:
+    """
+    Arranca (una sola vez por proceso) el hilo de prefetch de la watchlist.
+    Devuelve el hilo, o None si PREFETCH_ACTIVO está desactivado.
+    """
+    global _prefetch
+    if os.getenv("PREFETCH_ACTIVO", "0") != "1":
+        return None
+    with _prefetch_lock:
+        if _prefetch is None or not _prefetch.is_alive():
+            _prefetch = PrefetchWatchlist(
+                WATCHLIST_YAHOO,
+                WATCHLIST_COINGECKO,
+                PREFETCH_DIAS_COINGECKO,
+                PREFETCH_INTERVALO_SEG,
+            )
+            _prefetch.start()
+            print(f"Prefetch de watchlist iniciado ({len(WATCHLIST_YAHOO)} tickers, "
+                  f"{len(WATCHLIST_COINGECKO)} criptos, cada {PREFETCH_INTERVALO_SEG:.0f}s).")
+    return _prefetch
+
+if __name__ == "__main__":
+    # Ejecuta un único ciclo de prefetch para comprobar la watchlist y los tiempos.
+    print("Ejecutando un ciclo de prefetch de la watchlist...")
+    prefetch = PrefetchWatchlist(WATCHLIST_YAHOO, WATCHLIST_COINGECKO,
+                                 PREFETCH_DIAS_COINGECKO, PREFETCH_INTERVALO_SEG)
+    print(prefetch.ejecutar_ciclo())
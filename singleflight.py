@@ -0,0 +1,84 @@
+# singleflight.py
+"""
+Coalescencia "single-flight" de llamadas concurrentes idénticas.
+
+Cuando varias sesiones piden a la vez el mismo dato (por ejemplo el histórico de
+BTC-USD), solo la primera llamada sale a la red; el resto espera a que termine y
+comparte su resultado (o su excepción). Los resultados compartidos deben tratarse
+como de solo lectura.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Llamada:
+    """Llamada en curso: el resultado lo rellena el hilo líder y lo leen los que esperan."""
+
+    def __init__(self):
+        self.terminada = threading.Event()
+        self.resultado: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave en una sola ejecución.
+
+    Métricas disponibles en metricas():
+        llamadas     Total de llamadas recibidas.
+        ejecuciones  Llamadas que realmente ejecutaron la función.
+        coalescidas  Llamadas que esperaron y reutilizaron el resultado de otra.
+    """
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._lock = threading.Lock()
+        self._en_curso: Dict[Hashable, _Llamada] = {}
+        self._llamadas = 0
+        self._ejecuciones = 0
+        self._coalescidas = 0
+
+    def ejecutar(self, clave: Hashable, funcion: Callable[[], Any]) -> Any:
+        """
+        Ejecuta 'funcion' salvo que ya haya una llamada en curso con la misma clave,
+        en cuyo caso espera su resultado. Las excepciones se propagan a todos los que esperan.
+        """
+        with self._lock:
+            self._llamadas += 1
+            llamada = self._en_curso.get(clave)
+            if llamada is not None:
+                self._coalescidas += 1
+                lider = False
+            else:
+                llamada = _Llamada()
+                self._en_curso[clave] = llamada
+                self._ejecuciones += 1
+                lider = True
+
+        if not lider:
+            llamada.terminada.wait()
+            if llamada.error is not None:
+                raise llamada.error
+            return llamada.resultado
+
+        try:
+            llamada.resultado = funcion()
+            return llamada.resultado
+        except BaseException as e:
+            llamada.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_curso.pop(clave, None)
+            llamada.terminada.set()
+
+    def metricas(self) -> Dict[str, int]:
+        """Devuelve un resumen de las llamadas recibidas, ejecutadas y coalescidas."""
+        with self._lock:
+            return {
+                "llamadas": self._llamadas,
+                "ejecuciones": self._ejecuciones,
+                "coalescidas": self._coalescidas,
+                "en_curso": len(self._en_curso),
+            }
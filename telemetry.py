@@ -0,0 +1,256 @@
+# telemetry.py
+"""
+Instrumentación del asistente: spans con tiempos y atributos (tokens, tamaños de
+payload, filas) alrededor de llamadas al LLM, herramientas, peticiones HTTP y
+sentencias SQL.
+
+Cada span terminado se:
+    - agrega a las métricas del proceso (expuestas en formato Prometheus),
+    - añade al turno de chat en curso, si hay uno abierto con turno(),
+    - escribe como una línea JSON en TRACE_FILE, si está configurado.
+
+Configuración (variables de entorno):
+    TRACE_FILE      Ruta del archivo JSONL de trazas (vacío = desactivado).
+    METRICS_PORT    Puerto del endpoint /metrics que arranca app.py (vacío = desactivado).
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+
+# Spans del turno de chat en curso y span padre actual. Las herramientas que LangGraph
+# ejecuta en otros hilos heredan el contexto, así que sus spans llegan al mismo turno.
+_turno_actual: contextvars.ContextVar = contextvars.ContextVar("turno_actual", default=None)
+_span_padre: contextvars.ContextVar = contextvars.ContextVar("span_padre", default=None)
+
+
+class _Metricas:
+    """Agregados por (tipo, nombre) de los spans terminados, thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: Dict[tuple, Dict[str, float]] = {}
+        self._tokens: Dict[tuple, int] = {}
+
+    def registrar(self, span: dict):
+        clave = (span["tipo"], span["nombre"])
+        atributos = span["atributos"]
+        with self._lock:
+            agregado = self._spans.setdefault(clave, {"count": 0, "sum": 0.0, "errores": 0, "bytes": 0})
+            agregado["count"] += 1
+            agregado["sum"] += span["duracion_seg"]
+            agregado["errores"] += 1 if span["error"] else 0
+            agregado["bytes"] += atributos.get("bytes", 0) or 0
+            for tipo_token in ("tokens_entrada", "tokens_salida"):
+                if atributos.get(tipo_token):
+                    clave_token = (span["nombre"], tipo_token)
+                    self._tokens[clave_token] = self._tokens.get(clave_token, 0) + atributos[tipo_token]
+
+    def exposicion_prometheus(self) -> str:
+        """Devuelve las métricas en el formato de texto de Prometheus."""
+        lineas = [
+            "# HELP asistente_span_segundos Duración de las operaciones instrumentadas.",
+            "# TYPE asistente_span_segundos summary",
+        ]
+        with self._lock:
+            spans = dict(self._spans)
+            tokens = dict(self._tokens)
+        for (tipo, nombre), agregado in sorted(spans.items()):
+            etiquetas = f'tipo="{tipo}",nombre="{_escapar(nombre)}"'
+            lineas.append(f"asistente_span_segundos_count{{{etiquetas}}} {agregado['count']}")
+            lineas.append(f"asistente_span_segundos_sum{{{etiquetas}}} {agregado['sum']:.6f}")
+        lineas += ["# HELP asistente_span_errores_total Operaciones instrumentadas que terminaron con excepción.",
+                   "# TYPE asistente_span_errores_total counter"]
+        for (tipo, nombre), agregado in sorted(spans.items()):
+            lineas.append(f'asistente_span_errores_total{{tipo="{tipo}",nombre="{_escapar(nombre)}"}} {agregado["errores"]}')
+        lineas += ["# HELP asistente_payload_bytes_total Bytes recibidos o enviados por las operaciones instrumentadas.",
+                   "# TYPE asistente_payload_bytes_total counter"]
+        for (tipo, nombre), agregado in sorted(spans.items()):
+            if agregado["bytes"]:
+                lineas.append(f'asistente_payload_bytes_total{{tipo="{tipo}",nombre="{_escapar(nombre)}"}} {agregado["bytes"]}')
+        lineas += ["# HELP asistente_llm_tokens_total Tokens consumidos por modelo.",
+                   "# TYPE asistente_llm_tokens_total counter"]
+        for (modelo, tipo_token), total in sorted(tokens.items()):
+            lineas.append(f'asistente_llm_tokens_total{{modelo="{_escapar(modelo)}",tipo="{tipo_token}"}} {total}')
+        return "\n".join(lineas) + "\n"
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+metricas = _Metricas()
+_trace_lock = threading.Lock()
+_trace_archivo = None  # se abre una vez, con buffer de línea, en el primer span
+
+def registrar_span(tipo: str, nombre: str, inicio: float, duracion_seg: float,
+                   atributos: Optional[Dict[str, Any]] = None, error: Optional[str] = None,
+                   span_id: Optional[str] = None, padre: Optional[str] = None) -> dict:
+    """
+    Registra un span ya terminado. La usan span() y los callbacks de LangChain,
+    donde el inicio y el fin llegan en eventos separados.
+    """
+    registro = {
+        "id": span_id or uuid.uuid4().hex[:16],
+        "padre": padre if padre is not None else _span_padre.get(),
+        "tipo": tipo,
+        "nombre": nombre,
+        "inicio": inicio,
+        "duracion_seg": duracion_seg,
+        "atributos": atributos or {},
+        "error": error,
+    }
+    metricas.registrar(registro)
+    spans_turno = _turno_actual.get()
+    if spans_turno is not None:
+        spans_turno.append(registro)
+    if TRACE_FILE:
+        linea = json.dumps(registro, ensure_ascii=False, default=str)
+        _escribir_traza(linea)
+    return registro
+
+def _escribir_traza(linea: str) -> None:
+    global _trace_archivo
+    with _trace_lock:
+        if _trace_archivo is None:
+            _trace_archivo = open(TRACE_FILE, "a", encoding="utf-8", buffering=1)
+        _trace_archivo.write(linea + "\n")
+
+@contextmanager
+def span(tipo: str, nombre: str, **atributos):
+    """
+    Mide el bloque como un span. Devuelve el diccionario de atributos para que el
+    bloque pueda añadir datos conocidos al final (bytes, filas, tokens...).
+
+        with span("http", "coingecko.market_chart") as attrs:
+            response = ...
+            attrs["bytes"] = len(response.content)
+    """
+    span_id = uuid.uuid4().hex[:16]
+    padre = _span_padre.get()
+    token = _span_padre.set(span_id)
+    inicio, t0 = time.time(), time.perf_counter()
+    error = None
+    try:
+        yield atributos
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _span_padre.reset(token)
+        registrar_span(tipo, nombre, inicio, time.perf_counter() - t0, atributos, error,
+                       span_id=span_id, padre=padre)
+
+@contextmanager
+def turno(nombre: str = "consulta"):
+    """
+    Abre un turno de chat: todos los spans terminados dentro (también en hilos que
+    hereden el contexto) se acumulan en la lista devuelta.
+    """
+    spans: List[dict] = []
+    token = _turno_actual.set(spans)
+    try:
+        with span("turno", nombre):
+            yield spans
+    finally:
+        _turno_actual.reset(token)
+
+def resumen_turno(spans: List[dict]) -> List[Dict[str, Any]]:
+    """Agrupa los spans de un turno por tipo y nombre para mostrarlos en la interfaz."""
+    filas: Dict[tuple, Dict[str, Any]] = {}
+    for s in spans:
+        fila = filas.setdefault((s["tipo"], s["nombre"]), {
+            "tipo": s["tipo"], "nombre": s["nombre"], "llamadas": 0, "ms": 0.0, "tokens": 0, "bytes": 0, "errores": 0,
+        })
+        fila["llamadas"] += 1
+        fila["ms"] += s["duracion_seg"] * 1000
+        fila["tokens"] += (s["atributos"].get("tokens_entrada") or 0) + (s["atributos"].get("tokens_salida") or 0)
+        fila["bytes"] += s["atributos"].get("bytes") or 0
+        fila["errores"] += 1 if s["error"] else 0
+    return sorted(filas.values(), key=lambda f: f["ms"], reverse=True)
+
+
+class ManejadorTelemetria(BaseCallbackHandler):
+    """
+    Callback de LangChain que registra un span por cada invocación de modelo (con tokens
+    y tamaño del prompt) y por cada ejecución de herramienta.
+    """
+
+    def __init__(self):
+        self._abiertos: Dict[Any, tuple] = {}
+
+    def _abrir(self, run_id, tipo: str, nombre: str, atributos: dict):
+        self._abiertos[run_id] = (tipo, nombre, time.time(), time.perf_counter(), atributos, _span_padre.get())
+
+    def _cerrar(self, run_id, error: Optional[BaseException] = None, **atributos_fin):
+        abierto = self._abiertos.pop(run_id, None)
+        if abierto is None:
+            return
+        tipo, nombre, inicio, t0, atributos, padre = abierto
+        atributos.update(atributos_fin)
+        registrar_span(tipo, nombre, inicio, time.perf_counter() - t0, atributos,
+                       f"{type(error).__name__}: {error}" if error else None, padre=padre)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        parametros = kwargs.get("invocation_params") or {}
+        modelo = parametros.get("model_name") or parametros.get("model") or (serialized or {}).get("name", "llm")
+        bytes_prompt = sum(len(str(m.content)) for lote in messages for m in lote)
+        self._abrir(run_id, "llm", modelo, {"bytes": bytes_prompt})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        uso = (response.llm_output or {}).get("token_usage") or {}
+        entrada, salida = uso.get("prompt_tokens"), uso.get("completion_tokens")
+        if entrada is None and response.generations and response.generations[0]:
+            mensaje = getattr(response.generations[0][0], "message", None)
+            metadatos = getattr(mensaje, "usage_metadata", None) or {}
+            entrada, salida = metadatos.get("input_tokens"), metadatos.get("output_tokens")
+        self._cerrar(run_id, tokens_entrada=entrada or 0, tokens_salida=salida or 0)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._cerrar(run_id, error=error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        nombre = (serialized or {}).get("name", "herramienta")
+        self._abrir(run_id, "herramienta", nombre, {"bytes": len(str(input_str))})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        contenido = getattr(output, "content", output)
+        abierto = self._abiertos.get(run_id)
+        bytes_entrada = abierto[4].get("bytes", 0) if abierto else 0
+        self._cerrar(run_id, bytes=bytes_entrada + len(str(contenido)))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._cerrar(run_id, error=error)
+
+def iniciar_servidor_metricas(puerto: int) -> ThreadingHTTPServer:
+    """Arranca en un hilo daemon un endpoint HTTP que sirve las métricas en /metrics."""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = metricas.exposicion_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(("0.0.0.0", puerto), _Handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas", daemon=True).start()
+    print(f"Endpoint de métricas Prometheus en http://0.0.0.0:{puerto}/metrics")
+    return servidor